@@ -1,70 +1,199 @@
 #!/usr/bin/env python3
 import asyncio
 import csv
+import os
 from asyncua import Client, ua
 
+OPC_SERVER_URL = os.environ.get('OPC_SERVER_URL', "opc.tcp://host.docker.internal:4841")
+# Browse and Read requests in flight at once
+BROWSE_CONCURRENCY = int(os.environ.get('BROWSE_CONCURRENCY', 8))
+# Used when the server reports an operation limit as 0 (no limit) or doesn't expose it
+DEFAULT_MAX_NODES_PER_BROWSE = int(os.environ.get('DEFAULT_MAX_NODES_PER_BROWSE', 500))
+DEFAULT_MAX_NODES_PER_READ = int(os.environ.get('DEFAULT_MAX_NODES_PER_READ', 1000))
+CSV_COLUMNS = ["NodeId", "BrowseName", "ParentNodeId", "DataType", "DisplayName", "Description"]
+
+def plain_node_id(node_id):
+    # Browse results carry ExpandedNodeIds; requests want plain NodeIds
+    return ua.NodeId(node_id.Identifier, node_id.NamespaceIndex, node_id.NodeIdType)
+
+def parse_node_ids(node_ids):
+    # node id string -> NodeId, plus node id string -> error for the ones that don't parse
+    parsed, invalid = {}, {}
+    for node_id in node_ids:
+        try:
+            parsed[node_id] = ua.NodeId.from_string(node_id)
+        except Exception as e:
+            invalid[node_id] = f"Invalid node id: {e}"
+    return parsed, invalid
+
 class NodeCSVExporter:
     def __init__(self):
-        self.nodes = []
+        # node id string -> {"nodeid", "browse_name", "display_name", "node_class", "parent"}
+        self.nodes = {}
         self.client = None
         self.aliases = {}
+        self.max_nodes_per_browse = DEFAULT_MAX_NODES_PER_BROWSE
+        self.max_nodes_per_read = DEFAULT_MAX_NODES_PER_READ
+        self.semaphore = asyncio.Semaphore(BROWSE_CONCURRENCY)
+
+    async def read_operation_limits(self):
+        limits = self.client.nodes.server
+        for attr, name, default in (("max_nodes_per_browse", "MaxNodesPerBrowse", DEFAULT_MAX_NODES_PER_BROWSE),
+                                    ("max_nodes_per_read", "MaxNodesPerRead", DEFAULT_MAX_NODES_PER_READ)):
+            try:
+                node = await limits.get_child(["0:ServerCapabilities", "0:OperationLimits", f"0:{name}"])
+                setattr(self, attr, await node.read_value() or default)
+            except Exception:
+                setattr(self, attr, default)
 
     async def start_node_browse(self, rootnode):
-        await self.iterate_over_child_nodes(rootnode)
+        self.nodes[rootnode.nodeid.to_string()] = {
+            "nodeid": rootnode.nodeid,
+            "browse_name": await rootnode.read_browse_name(),
+            "display_name": await rootnode.read_display_name(),
+            "node_class": await rootnode.read_node_class(),
+            "parent": None,
+        }
+        await self.browse_tree([rootnode.nodeid], self.nodes)
 
-    async def iterate_over_child_nodes(self, node):
-        self.nodes.append(node)
-        for child in await node.get_children(refs=33):
-            if child not in self.nodes:
-                await self.iterate_over_child_nodes(child)
+    async def browse_tree(self, root_ids, visited, reference_type=ua.ObjectIds.HierarchicalReferences):
+        # Breadth first: every level is browsed with as few Browse calls as the
+        # server's limits allow, and the calls of one level run concurrently
+        level = list(root_ids)
+        while level:
+            chunks = [level[i:i + self.max_nodes_per_browse] for i in range(0, len(level), self.max_nodes_per_browse)]
+            next_level = []
+            for chunk_results in await asyncio.gather(*(self.browse_chunk(chunk, reference_type) for chunk in chunks)):
+                for parent_id, references in chunk_results:
+                    for ref in references:
+                        key = ref.NodeId.to_string()
+                        if key in visited or getattr(ref.NodeId, 'ServerIndex', 0):
+                            continue
+                        node_id = plain_node_id(ref.NodeId)
+                        visited[key] = {
+                            "nodeid": node_id,
+                            "browse_name": ref.BrowseName,
+                            "display_name": ref.DisplayName,
+                            "node_class": ref.NodeClass,
+                            "parent": parent_id,
+                        }
+                        next_level.append(node_id)
+            level = next_level
+
+    async def browse_chunk(self, node_ids, reference_type):
+        params = ua.BrowseParameters()
+        params.RequestedMaxReferencesPerNode = 0
+        for node_id in node_ids:
+            desc = ua.BrowseDescription()
+            desc.NodeId = node_id
+            desc.BrowseDirection = ua.BrowseDirection.Forward
+            desc.ReferenceTypeId = ua.NodeId(reference_type)
+            desc.IncludeSubtypes = True
+            desc.NodeClassMask = 0
+            desc.ResultMask = ua.BrowseResultMask.All
+            params.NodesToBrowse.append(desc)
+        async with self.semaphore:
+            results = await self.client.uaclient.browse(params)
+            references = [list(result.References) for result in results]
+            pending = {i: result.ContinuationPoint for i, result in enumerate(results) if result.ContinuationPoint}
+            while pending:
+                next_params = ua.BrowseNextParameters()
+                next_params.ReleaseContinuationPoints = False
+                next_params.ContinuationPoints = list(pending.values())
+                next_results = await self.client.uaclient.browse_next(next_params)
+                for i, result in zip(list(pending), next_results):
+                    references[i].extend(result.References)
+                    if result.ContinuationPoint:
+                        pending[i] = result.ContinuationPoint
+                    else:
+                        del pending[i]
+        return list(zip(node_ids, references))
+
+    async def read_attributes(self, node_ids, attribute_id):
+        # Returns DataValues in node_ids order, read in concurrent chunks of MaxNodesPerRead
+        chunks = [node_ids[i:i + self.max_nodes_per_read] for i in range(0, len(node_ids), self.max_nodes_per_read)]
+
+        async def read_chunk(chunk):
+            params = ua.ReadParameters()
+            for node_id in chunk:
+                rv = ua.ReadValueId()
+                rv.NodeId = node_id
+                rv.AttributeId = attribute_id
+                params.NodesToRead.append(rv)
+            async with self.semaphore:
+                return await self.client.uaclient.read(params)
+
+        return [data_value for chunk_result in await asyncio.gather(*(read_chunk(c) for c in chunks)) for data_value in chunk_result]
 
     async def load_aliases_from_server(self):
         datatypes_node = await self.client.nodes.root.get_child(["0:Types", "0:DataTypes"])
-        await self.recursively_load_datatypes(datatypes_node)
+        datatypes = {}
+        await self.browse_tree([datatypes_node.nodeid], datatypes)
+        for key, record in datatypes.items():
+            self.aliases[key] = record["browse_name"].Name
 
-    async def recursively_load_datatypes(self, node):
-        try:
-            browse_name = await node.read_browse_name()
-            node_id = node.nodeid
-            self.aliases[node_id.to_string()] = browse_name.Name
-            for child in await node.get_children():
-                await self.recursively_load_datatypes(child)
-        except:
-            pass
+    async def build_rows(self, records, namespace_index=2):
+        # CSV rows for the given browse records, attributes read in batches
+        nodes = [record for record in records if record["nodeid"].NamespaceIndex == namespace_index]
+        node_ids = [record["nodeid"] for record in nodes]
+        descriptions = await self.read_attributes(node_ids, ua.AttributeIds.Description)
+        variables = [record["nodeid"] for record in nodes if record["node_class"] == ua.NodeClass.Variable]
+        datatypes = dict(zip([n.to_string() for n in variables], await self.read_attributes(variables, ua.AttributeIds.DataType)))
+        return [self.node_to_row(record, description, datatypes.get(record["nodeid"].to_string()))
+                for record, description in zip(nodes, descriptions)]
+
+    async def read_node_rows(self, node_ids):
+        # CSV rows (without parent) of the given node ids as the server knows them, and
+        # node id -> error for the ones it doesn't; every attribute is read in batches
+        parsed, invalid = parse_node_ids(node_ids)
+        ids = list(parsed.values())
+        node_classes, browse_names, display_names, descriptions, datatypes = await asyncio.gather(*(
+            self.read_attributes(ids, attribute) for attribute in (
+                ua.AttributeIds.NodeClass, ua.AttributeIds.BrowseName, ua.AttributeIds.DisplayName,
+                ua.AttributeIds.Description, ua.AttributeIds.DataType)))
+        rows = {}
+        for index, (node_id, nodeid) in enumerate(parsed.items()):
+            if not node_classes[index].StatusCode.is_good():
+                invalid[node_id] = node_classes[index].StatusCode.name
+                continue
+            record = {"nodeid": nodeid, "browse_name": browse_names[index].Value.Value,
+                      "display_name": display_names[index].Value.Value, "parent": None}
+            rows[node_id] = self.node_to_row(record, descriptions[index], datatypes[index])
+        return rows, invalid
+
+    async def browse_subtrees(self, root_ids):
+        # Browse records below the given nodes, not including the nodes themselves
+        records = {root_id.to_string(): None for root_id in root_ids}
+        await self.browse_tree(root_ids, records)
+        return [record for record in records.values() if record is not None]
 
     async def export_csv(self, output_file="nodes_output.csv"):
-        nodes = [node for node in self.nodes if node.nodeid.NamespaceIndex == 2]
+        rows = await self.build_rows(list(self.nodes.values()))
         with open(output_file, 'w', newline='', encoding='utf-8') as csvfile:
             writer = csv.writer(csvfile)
-            writer.writerow(["NodeId", "BrowseName", "ParentNodeId", "DataType", "DisplayName", "Description"])
-            for node in nodes:
-                await self.node_to_csv(node, writer)
-
-    async def node_to_csv(self, node, writer):
-        nodeid = node.nodeid.to_string()
-        browsename = (await node.read_browse_name()).to_string()
-        parent = await node.get_parent()
-        parent_nodeid = parent.nodeid.to_string() if parent else ""
-        
-        if await node.read_node_class() == ua.NodeClass.Variable:
-            datatype = await node.read_data_type()
-            datatype_str = self.aliases.get(datatype.to_string(), datatype.to_string())
+            writer.writerow(CSV_COLUMNS)
+            writer.writerows(rows)
+
+    def node_to_row(self, record, description, datatype):
+        nodeid = record["nodeid"].to_string()
+        parent_nodeid = record["parent"].to_string() if record["parent"] else ""
+        if datatype is not None and datatype.StatusCode.is_good():
+            datatype_str = datatype.Value.Value.to_string()
+            datatype_str = self.aliases.get(datatype_str, datatype_str)
         else:
             datatype_str = ""
+        description_value = description.Value.Value if description.StatusCode.is_good() else None
+        description_str = description_value.Text if description_value and description_value.Text else ""
+        return [nodeid, record["browse_name"].to_string(), parent_nodeid, datatype_str, record["display_name"].Text, description_str]
 
-        displayname = (await node.read_display_name()).Text
-        
-        try:
-            description = (await node.read_description()).Text
-        except:
-            description = ""
-
-        writer.writerow([nodeid, browsename, parent_nodeid, datatype_str, displayname, description])
-
-    async def import_nodes(self):
-        self.client = Client("opc.tcp://host.docker.internal:4841")
+    async def connect(self):
+        self.client = Client(OPC_SERVER_URL)
         await self.client.connect()
+        await self.read_operation_limits()
         await self.load_aliases_from_server()
+
+    async def import_nodes(self):
+        await self.connect()
         root = self.client.get_root_node()
         await self.start_node_browse(root)
 
@@ -75,4 +204,4 @@ async def main():
     await exporter.client.disconnect()
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
@@ -0,0 +1,97 @@
+import threading
+import time
+
+# Streaming downsampling for the MQTT to InfluxDB converter. Every node keeps a
+# fixed-size ring of tumbling-window buckets per window length; a bucket is
+# emitted as (node, window, start_ns, count, min, max, mean, last) once newer
+# buckets push it out of the ring or once it stopped receiving samples. The
+# ring gives late samples a few windows to arrive before their bucket is closed;
+# samples for a bucket that was already emitted are counted as late, not emitted twice.
+
+NS_PER_S = 1_000_000_000
+
+# Slot layout: bucket id, count, min, max, sum, last, last timestamp, last update (monotonic)
+_ID, _COUNT, _MIN, _MAX, _SUM, _LAST, _LAST_TS, _UPDATED = range(8)
+
+def window_label(seconds):
+    if seconds % 3600 == 0:
+        return f"{seconds // 3600}h"
+    if seconds % 60 == 0:
+        return f"{seconds // 60}m"
+    return f"{seconds}s"
+
+def parse_windows(text):
+    return sorted({int(part) for part in text.split(",") if part.strip()})
+
+class WindowAggregator:
+    def __init__(self, windows, emit, slots=4, grace=2.0):
+        self.windows = [(seconds, seconds * NS_PER_S) for seconds in windows]
+        self.emit = emit
+        self.slots = slots
+        self.grace = grace
+        self._rings = {}  # node -> [ring per window], ring = list of slots (None when empty)
+        self._emitted_ids = {}  # node -> [id of the newest emitted bucket per window]
+        self._lock = threading.Lock()
+        self.aggregated = 0
+        self.emitted = 0
+        self.late = 0
+
+    def add(self, node, value, timestamp_ns):
+        now = time.monotonic()
+        closed = []
+        with self._lock:
+            rings = self._rings.get(node)
+            if rings is None:
+                rings = self._rings[node] = [[None] * self.slots for _ in self.windows]
+                self._emitted_ids[node] = [-1] * len(self.windows)
+            emitted_ids = self._emitted_ids[node]
+            for window_index, ((seconds, window_ns), ring) in enumerate(zip(self.windows, rings)):
+                bucket_id = timestamp_ns // window_ns
+                index = bucket_id % self.slots
+                slot = ring[index]
+                if slot is None or slot[_ID] != bucket_id:
+                    if bucket_id <= emitted_ids[window_index] or (slot is not None and slot[_ID] > bucket_id):
+                        # Its bucket was emitted already, or it's older than anything the ring holds
+                        self.late += 1
+                        continue
+                    if slot is not None:
+                        closed.append((node, seconds, window_ns, slot))
+                        emitted_ids[window_index] = max(emitted_ids[window_index], slot[_ID])
+                        slot = None
+                if slot is None:
+                    ring[index] = [bucket_id, 1, value, value, value, value, timestamp_ns, now]
+                    continue
+                slot[_COUNT] += 1
+                slot[_SUM] += value
+                if value < slot[_MIN]:
+                    slot[_MIN] = value
+                if value > slot[_MAX]:
+                    slot[_MAX] = value
+                if timestamp_ns >= slot[_LAST_TS]:
+                    slot[_LAST] = value
+                    slot[_LAST_TS] = timestamp_ns
+                slot[_UPDATED] = now
+            self.aggregated += 1
+        self._emit(closed)
+
+    def flush_idle(self, force=False):
+        # Emits buckets that haven't been updated for their window length plus
+        # the grace period (all of them with force, e.g. on shutdown)
+        now = time.monotonic()
+        closed = []
+        with self._lock:
+            for node, rings in self._rings.items():
+                emitted_ids = self._emitted_ids[node]
+                for window_index, ((seconds, window_ns), ring) in enumerate(zip(self.windows, rings)):
+                    for index, slot in enumerate(ring):
+                        if slot is not None and (force or now - slot[_UPDATED] >= seconds + self.grace):
+                            closed.append((node, seconds, window_ns, slot))
+                            emitted_ids[window_index] = max(emitted_ids[window_index], slot[_ID])
+                            ring[index] = None
+        self._emit(closed)
+
+    def _emit(self, closed):
+        for node, seconds, window_ns, slot in closed:
+            self.emit(node, window_label(seconds), slot[_ID] * window_ns, slot[_COUNT], slot[_MIN], slot[_MAX],
+                      slot[_SUM] / slot[_COUNT], slot[_LAST])
+        self.emitted += len(closed)
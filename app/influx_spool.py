@@ -0,0 +1,126 @@
+import json
+import os
+import threading
+
+class SegmentSpool:
+    # Append-only write-ahead spool of line protocol records, split into numbered
+    # segment files. New records always go to the active (highest numbered)
+    # segment; replay reads closed segments oldest first and records its position
+    # in an offset file, so a restart resumes where it left off. The oldest
+    # segments are deleted once the spool grows past max_bytes.
+    def __init__(self, directory, segment_bytes, max_bytes, fsync=False):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.fsync = fsync
+        self.spooled = 0
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._offset_file = os.path.join(directory, "replay.offset")
+        os.makedirs(directory, exist_ok=True)
+        self._segments = sorted(name for name in os.listdir(directory) if name.startswith("segment-") and name.endswith(".lp"))
+        self._total_bytes = sum(os.path.getsize(self._segment_path(name)) for name in self._segments)
+        self._replay_segment, self._replay_offset = self._load_offset()
+        # Never append to a segment left over from a previous run, its tail may be torn
+        self._active = None
+        self._active_size = 0
+        self._open_new_segment()
+
+    def _segment_path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _load_offset(self):
+        try:
+            with open(self._offset_file, mode='r') as file:
+                state = json.load(file)
+            if state["segment"] in self._segments:
+                return state["segment"], state["offset"]
+        except (OSError, ValueError, KeyError):
+            pass
+        return None, 0
+
+    def _save_offset(self):
+        tmp_file = self._offset_file + ".tmp"
+        with open(tmp_file, mode='w') as file:
+            json.dump({"segment": self._replay_segment, "offset": self._replay_offset}, file)
+        os.replace(tmp_file, self._offset_file)
+
+    def _open_new_segment(self):
+        if self._active:
+            self._active.close()
+        last = int(self._segments[-1][8:-3]) if self._segments else 0
+        name = f"segment-{last + 1:012d}.lp"
+        self._segments.append(name)
+        self._active = open(self._segment_path(name), mode='ab')
+        self._active_size = 0
+
+    def size_bytes(self):
+        return self._total_bytes
+
+    def append(self, lines):
+        if not lines:
+            return
+        data = ("\n".join(lines) + "\n").encode()
+        with self._lock:
+            self._active.write(data)
+            self._active.flush()
+            if self.fsync:
+                os.fsync(self._active.fileno())
+            self._active_size += len(data)
+            self._total_bytes += len(data)
+            self.spooled += len(lines)
+            if self._active_size >= self.segment_bytes:
+                self._open_new_segment()
+            self._enforce_size_cap()
+
+    def _enforce_size_cap(self):
+        # Drops whole closed segments, oldest first, never the one being written
+        while len(self._segments) > 1 and self._total_bytes > self.max_bytes:
+            name = self._segments.pop(0)
+            path = self._segment_path(name)
+            self._total_bytes -= os.path.getsize(path)
+            with open(path, mode='rb') as file:
+                if name == self._replay_segment:
+                    file.seek(self._replay_offset)
+                self.dropped += sum(1 for _ in file)
+            os.remove(path)
+            if name == self._replay_segment:
+                self._replay_segment, self._replay_offset = None, 0
+            print(f"Spool over {self.max_bytes} bytes, dropped segment {name}")
+
+    def read_chunk(self, max_lines):
+        # Returns (position, lines); pass position to commit() once the lines are written
+        with self._lock:
+            if len(self._segments) == 1:
+                if not self._active_size:
+                    return None, []
+                self._open_new_segment()
+            name = self._segments[0]
+            offset = self._replay_offset if name == self._replay_segment else 0
+        lines = []
+        try:
+            with open(self._segment_path(name), mode='rb') as file:
+                file.seek(offset)
+                for raw_line in file:
+                    lines.append(raw_line.decode(errors='replace').rstrip("\n"))
+                    if len(lines) >= max_lines:
+                        break
+                position = (name, file.tell(), file.tell() >= os.fstat(file.fileno()).st_size)
+        except FileNotFoundError:
+            # Dropped by the size cap while we were reading
+            return None, []
+        return position, [line for line in lines if line]
+
+    def commit(self, position):
+        name, offset, at_end = position
+        with self._lock:
+            if not self._segments or self._segments[0] != name:
+                return
+            if at_end:
+                self._segments.pop(0)
+                self._total_bytes -= os.path.getsize(self._segment_path(name))
+                os.remove(self._segment_path(name))
+                self._replay_segment, self._replay_offset = None, 0
+            else:
+                self._replay_segment, self._replay_offset = name, offset
+            self._save_offset()
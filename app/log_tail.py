@@ -0,0 +1,120 @@
+import asyncio
+import os
+
+# Tails the application and converter logs for the log page. One watcher polls
+# the files by offset and fans new lines out to every subscriber, so the cost
+# doesn't grow with the number of open tabs or with the size of the files.
+POLL_INTERVAL = float(os.environ.get('LOG_TAIL_POLL_INTERVAL', 0.5))
+SUBSCRIBER_QUEUE_SIZE = 100
+MAX_READ_PER_POLL = 1024 * 1024
+
+def tail_lines(path, count, end=None, block_size=8192):
+    # Last `count` complete lines before byte offset `end` (EOF by default),
+    # read backwards block by block instead of from the start of the file
+    with open(path, mode='rb') as file:
+        position = file.seek(0, os.SEEK_END) if end is None else end
+        data = b""
+        while position > 0 and data.count(b"\n") <= count:
+            step = min(block_size, position)
+            position -= step
+            file.seek(position)
+            data = file.read(step) + data
+    lines = data.decode(errors='replace').splitlines(keepends=True)
+    return lines[-count:] if count else []
+
+def last_line_end(path, end, block_size=8192):
+    # Byte offset right after the last newline before `end`, 0 if there is none
+    with open(path, mode='rb') as file:
+        position = end
+        while position > 0:
+            step = min(block_size, position)
+            position -= step
+            file.seek(position)
+            index = file.read(step).rfind(b"\n")
+            if index >= 0:
+                return position + index + 1
+    return 0
+
+class LogTailer:
+    # files: name -> path. Subscribers get ("lines", name, [lines]) and
+    # ("reset", name, []) events, the latter when a file was truncated or replaced.
+    def __init__(self, files, poll_interval=POLL_INTERVAL):
+        self.files = files
+        self.poll_interval = poll_interval
+        self._subscribers = set()
+        self._offsets = {}
+        self._inodes = {}
+        self._partial = {}
+        self._task = None
+        self.dropped = 0
+
+    def _start_at_eof(self, name):
+        # A last line that is still being written is left for poll() to read whole
+        try:
+            stat = os.stat(self.files[name])
+            offset = last_line_end(self.files[name], stat.st_size)
+        except OSError:
+            stat, offset = None, 0
+        self._offsets[name] = offset
+        self._inodes[name] = stat.st_ino if stat else None
+        self._partial[name] = b""
+
+    def subscribe(self):
+        if not self._subscribers:
+            for name in self.files:
+                self._start_at_eof(name)
+            self._task = asyncio.create_task(self.run())
+        queue = asyncio.Queue(SUBSCRIBER_QUEUE_SIZE)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        self._subscribers.discard(queue)
+        if not self._subscribers and self._task:
+            self._task.cancel()
+            self._task = None
+
+    def initial_lines(self, name, count):
+        # The window right before the line the watcher continues with, so a
+        # new subscriber sees neither gaps nor duplicates
+        end = self._offsets[name] - len(self._partial[name]) if name in self._offsets else None
+        try:
+            return tail_lines(self.files[name], count, end=end)
+        except OSError as e:
+            return [f"Error reading log file: {e}\n"]
+
+    def publish(self, event):
+        for queue in self._subscribers:
+            if queue.full():
+                # A stalled client loses its oldest events, it doesn't hold up the others
+                queue.get_nowait()
+                self.dropped += 1
+            queue.put_nowait(event)
+
+    def poll(self, name):
+        path = self.files[name]
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
+        if stat.st_ino != self._inodes[name] or stat.st_size < self._offsets[name]:
+            self._inodes[name] = stat.st_ino
+            self._offsets[name] = 0
+            self._partial[name] = b""
+            self.publish(("reset", name, []))
+        if stat.st_size == self._offsets[name]:
+            return
+        with open(path, mode='rb') as file:
+            file.seek(self._offsets[name])
+            data = file.read(min(stat.st_size - self._offsets[name], MAX_READ_PER_POLL))
+        self._offsets[name] += len(data)
+        data = self._partial[name] + data
+        complete, _, self._partial[name] = data.rpartition(b"\n")
+        if complete:
+            self.publish(("lines", name, (complete + b"\n").decode(errors='replace').splitlines(keepends=True)))
+
+    async def run(self):
+        while True:
+            for name in self.files:
+                self.poll(name)
+            await asyncio.sleep(self.poll_interval)
@@ -1,14 +1,25 @@
-from fastapi import FastAPI, HTTPException, Request, Form
-from fastapi.responses import HTMLResponse, JSONResponse
+from fastapi import FastAPI, HTTPException, Request, Form, Query, File, UploadFile
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel
+from typing import List, Optional
 import csv
+import io
+import json
 import os
 import logging
 import asyncio
-import paho.mqtt.client as mqtt
+import time
 from datetime import datetime
-from .NodeCsvExporter import NodeCSVExporter  # Import the NodeCSVExporter class
+from .node_snapshot import SnapshotRefresher, load_latest_snapshot, write_nodes_output_csv
+from .node_catalog import COLUMNS as CATALOG_COLUMNS, SETTINGS_COLUMNS, NodeCatalog
+from .NodeCsvExporter import NodeCSVExporter, parse_node_ids
+from .log_tail import LogTailer, tail_lines
+from .supervisor_log import STREAM_LIMIT, ConverterLog
+from .mqtt_manager import MqttManager
+from .pipeline_metrics import PipelineMetrics, load_snapshots, prometheus_text, status_view
+from .payload_codec import decode_samples
+from .value_cache import LatestValueCache
 from pydantic import BaseModel
 
 app = FastAPI()
@@ -17,22 +28,45 @@ templates = Jinja2Templates(directory="app/templates")
 DATA_CSV = "app/data.csv"
 SELECTED_CSV = "app/selected.csv"
 NODES_OUTPUT_CSV = "app/nodes_output.csv"  # Path to the output file from NodeCSVExporter
+CATALOG_DB = "app/catalog.db"
+MQTT_BROKER = os.environ.get('MQTT_BROKER', "host.docker.internal")
+MQTT_PORT = int(os.environ.get('MQTT_PORT', 1883))
+MQTT_KEEPALIVE = int(os.environ.get('MQTT_KEEPALIVE', 10))  # s, also bounds how long a dead broker goes unnoticed
+CONVERTER_SETTINGS_FILE = "app/converter_settings.json"  # Watched by the running OPC UA to MQTT converter
 LOG_FILE = "app/logs/application.log"
 OPCUA_TO_MQTT_LOG_FILE = "app/logs/opcua_to_mqtt.log"
 MQTT_TO_INFLUX_LOG_FILE = "app/logs/mqtt_to_influx.log"
+LOG_FILES = {"Application": LOG_FILE, "opcua_to_MQTT_Converter.py": OPCUA_TO_MQTT_LOG_FILE, "mqtt_to_Influx_Converter.py": MQTT_TO_INFLUX_LOG_FILE}
+LOG_WINDOW = 100  # Lines shown per log on the log page
+LOG_STREAM_KEEPALIVE = 15  # s
 OPCUA_TO_MQTT_SCRIPT = "app/opcua_to_MQTT_Converter.py"
 MQTT_TO_INFLUX_SCRIPT = "app/mqtt_to_Influx_Converter.py"
+# OPC UA to MQTT worker processes, each acquiring its hash partition of selected.csv
+OPCUA_TO_MQTT_WORKERS = max(1, int(os.environ.get('OPCUA_TO_MQTT_WORKERS', 1)))
+# Bridge topics feeding the latest-value cache (empty disables it) and how often /values/stream sends changes
+VALUE_CACHE_TOPIC = os.environ.get('VALUE_CACHE_TOPIC', 'plant1/#')
+VALUE_STREAM_INTERVAL = float(os.environ.get('VALUE_STREAM_INTERVAL', 1))  # s
+# Historical samples the bridge backfills after an outage; not latest values
+BACKFILL_TOPIC = os.environ.get('BACKFILL_TOPIC', 'plant1/_backfill')
+PUBLISHED_NODE_PREFIX = "ns=2;s=DB15."  # Stripped by the bridge from the node ids it publishes
+NODE_IMPORT_MAX = int(os.environ.get('NODE_IMPORT_MAX', 100000))  # Nodes per bulk upload
+NODE_EXPORT_BATCH_SIZE = 1000
+NODE_EXPORT_MEDIA_TYPES = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
 
 os.makedirs("app/logs", exist_ok=True)
 logging.basicConfig(filename=LOG_FILE, level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-opcua_to_mqtt_process = None
+# shard index -> {"process", "stats"}
+opcua_to_mqtt_workers = {}
 mqtt_to_influx_process = None
-
-async def run_node_csv_exporter():
-    exporter = NodeCSVExporter()
-    await exporter.import_nodes()
-    await exporter.export_csv(NODES_OUTPUT_CSV)
+converter_logs = {
+    OPCUA_TO_MQTT_SCRIPT: ConverterLog(OPCUA_TO_MQTT_LOG_FILE, OPCUA_TO_MQTT_SCRIPT),
+    MQTT_TO_INFLUX_SCRIPT: ConverterLog(MQTT_TO_INFLUX_LOG_FILE, MQTT_TO_INFLUX_SCRIPT),
+}
+snapshot_refresher = None
+log_tailer = LogTailer(LOG_FILES)
+mqtt_manager = MqttManager(MQTT_BROKER, MQTT_PORT, MQTT_KEEPALIVE)
+value_cache = LatestValueCache()
 
 def create_data_csv_from_nodes_output():
     with open(NODES_OUTPUT_CSV, mode='r') as input_file, open(DATA_CSV, mode='w', newline='') as output_file:
@@ -43,103 +77,336 @@ def create_data_csv_from_nodes_output():
             writer.writerow([row['NodeId'], row['Description']])
 
 
-async def startup_event():
-    await run_node_csv_exporter()
+def apply_snapshot(snapshot):
+    write_nodes_output_csv(snapshot, NODES_OUTPUT_CSV)
     create_data_csv_from_nodes_output()
+    catalog.sync_browsed(snapshot["rows"])
+
+def cache_values(client, userdata, message):
+    # Runs on the MQTT network thread for every bridge message
+    if message.topic == BACKFILL_TOPIC:
+        return
+    try:
+        samples = decode_samples(message.payload)
+    except Exception:
+        value_cache.invalid_payloads += 1
+        return
+    value_cache.update(samples, time.time_ns())
+
+def published_node_id(node_id):
+    # Catalog node ids and the short ones on the wire both address the cache
+    return node_id[len(PUBLISHED_NODE_PREFIX):] if node_id.startswith(PUBLISHED_NODE_PREFIX) else node_id
+
+async def load_and_refresh_snapshot():
+    # Loading and applying a large snapshot runs in threads, so requests are served meanwhile
+    global snapshot_refresher
+    snapshot = await asyncio.to_thread(load_latest_snapshot)
+    if snapshot:
+        try:
+            await asyncio.to_thread(apply_snapshot, snapshot)
+            logging.info(f"Loaded address space snapshot v{snapshot['version']} with {len(snapshot['rows'])} nodes")
+        except Exception as e:
+            logging.error(f"Error applying address space snapshot: {e}")
+    snapshot_refresher = SnapshotRefresher(snapshot, apply_snapshot)
+    await snapshot_refresher.run()
+
+async def startup_event():
+    # Serve the last known address space right away and re-check the server in the background
+    if VALUE_CACHE_TOPIC:
+        mqtt_manager.subscribe(VALUE_CACHE_TOPIC, cache_values)
+    mqtt_manager.start()
+    asyncio.create_task(load_and_refresh_snapshot())
 
 @app.on_event("startup")
 async def startup():
     await startup_event()
+
+@app.on_event("shutdown")
+async def shutdown():
+    mqtt_manager.stop()
+def read_converter_settings():
+    try:
+        with open(CONVERTER_SETTINGS_FILE, mode='r') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+def write_converter_settings(**changes):
+    # Replaced atomically so the converter never reads a partial file
+    settings = {**read_converter_settings(), **changes}
+    tmp_file = CONVERTER_SETTINGS_FILE + ".tmp"
+    with open(tmp_file, mode='w') as file:
+        json.dump(settings, file)
+    os.replace(tmp_file, CONVERTER_SETTINGS_FILE)
+
 def ensure_csv(file_path, header):
     if not os.path.exists(file_path):
         with open(file_path, mode='w', newline='') as file:
             csv.writer(file).writerow(header)
 ensure_csv(SELECTED_CSV, ["node_id", "browse_name", "description"])
 
+catalog = NodeCatalog(CATALOG_DB)
+if catalog.count() == 0:
+    catalog.import_csv(DATA_CSV, SELECTED_CSV)
+
 
 class Node(BaseModel):
     node_id: str
     description: str
 
+class NodeSettings(BaseModel):
+    # None falls back to the bridge default (READ_INTERVAL, no deadband)
+    interval: Optional[float] = None
+    deadband: Optional[float] = None
+    deadband_pct: Optional[float] = None
+
 class UpdateRequest(BaseModel):
     node_ids: list[str] = []
+    node_settings: dict[str, NodeSettings] = {}
+
+class NodeSettingsUpdate(BaseModel):
+    nodes: dict[str, NodeSettings]
+
+class SelectionDelta(BaseModel):
+    add: list[str] = []
+    remove: list[str] = []
 
 class IntervalUpdate(BaseModel):
     interval: int
 
 class ConverterToggle(BaseModel):
     turn_on: bool
-async def run_script(script_name):
-    global opcua_to_mqtt_process, mqtt_to_influx_process
-    log_file_path = OPCUA_TO_MQTT_LOG_FILE if script_name == OPCUA_TO_MQTT_SCRIPT else MQTT_TO_INFLUX_LOG_FILE
-    process = await asyncio.create_subprocess_exec('python3', script_name, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE)
-    if script_name == OPCUA_TO_MQTT_SCRIPT: opcua_to_mqtt_process = process
-    elif script_name == MQTT_TO_INFLUX_SCRIPT: mqtt_to_influx_process = process
-    while True:
-        line = await process.stdout.readline()
-        if not line: break
-        with open(log_file_path, 'a') as log_file:
-            log_file.write(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {script_name}: {line.decode().strip()}\n")
-    error = await process.stderr.read()
-    if error:
-        with open(log_file_path, 'a') as log_file:
-            log_file.write(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {script_name} Error: {error.decode().strip()}\n")
+async def run_script(script_name, shard=None):
+    global mqtt_to_influx_process
+    env, label = os.environ.copy(), script_name
+    if shard is not None:
+        env.update(SHARD_INDEX=str(shard), SHARD_COUNT=str(OPCUA_TO_MQTT_WORKERS))
+        if OPCUA_TO_MQTT_WORKERS > 1:
+            label = f"{script_name}[{shard}]"
+    process = await asyncio.create_subprocess_exec('python3', script_name, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, limit=STREAM_LIMIT, env=env)
+    stats = {"pid": process.pid, "started": time.time()}
+    if shard is not None: opcua_to_mqtt_workers[shard] = {"process": process, "stats": stats}
+    else: mqtt_to_influx_process = process
+    await converter_logs[script_name].capture(process, label, stats)
     await process.wait()
 
+def script_processes(script_name):
+    if script_name == OPCUA_TO_MQTT_SCRIPT:
+        return [worker["process"] for worker in opcua_to_mqtt_workers.values()]
+    return [mqtt_to_influx_process] if mqtt_to_influx_process else []
+
 def is_process_running(script_name):
-    return (opcua_to_mqtt_process if script_name == OPCUA_TO_MQTT_SCRIPT else mqtt_to_influx_process) is not None and (opcua_to_mqtt_process if script_name == OPCUA_TO_MQTT_SCRIPT else mqtt_to_influx_process).returncode is None
+    return any(process.returncode is None for process in script_processes(script_name))
 
 async def start_script(script_name):
-    if not is_process_running(script_name):
+    # Starts the converter, or for the sharded one every worker that isn't running
+    if script_name != OPCUA_TO_MQTT_SCRIPT:
+        if is_process_running(script_name):
+            return False
         asyncio.create_task(run_script(script_name))
         return True
-    return False
+    shards = [shard for shard in range(OPCUA_TO_MQTT_WORKERS)
+              if shard not in opcua_to_mqtt_workers or opcua_to_mqtt_workers[shard]["process"].returncode is not None]
+    for shard in shards:
+        asyncio.create_task(run_script(script_name, shard))
+    return bool(shards)
 
 def stop_script(script_name):
-    global opcua_to_mqtt_process, mqtt_to_influx_process
-    process = opcua_to_mqtt_process if script_name == OPCUA_TO_MQTT_SCRIPT else mqtt_to_influx_process
-    if process:
-        process.terminate()
-        if script_name == OPCUA_TO_MQTT_SCRIPT: opcua_to_mqtt_process = None
-        else: mqtt_to_influx_process = None
-        return True
-    return False
-
-def test_mqtt_connection():
-    try:
-        client = mqtt.Client()
-        client.connect("host.docker.internal", 1883, 60)
-        client.disconnect()
-        return True
-    except Exception as e:
-        logging.error(f"MQTT connection test failed: {e}")
-        return False
+    global mqtt_to_influx_process
+    processes = script_processes(script_name)
+    for process in processes:
+        if process.returncode is None:
+            process.terminate()
+    if script_name == OPCUA_TO_MQTT_SCRIPT: opcua_to_mqtt_workers.clear()
+    else: mqtt_to_influx_process = None
+    return bool(processes)
+
+def shard_status(shard):
+    worker = opcua_to_mqtt_workers.get(shard)
+    if not worker:
+        return {"shard": shard, "status": "stopped"}
+    process, stats = worker["process"], worker["stats"]
+    last_output = stats.get("last_output")
+    return {
+        "shard": shard,
+        "status": "running" if process.returncode is None else "exited",
+        "pid": stats["pid"],
+        "returncode": process.returncode,
+        "uptime": round(time.time() - stats["started"]),
+        "lines": stats.get("lines", 0),
+        "seconds_since_output": round(time.time() - last_output) if last_output else None,
+    }
 
 @app.get("/", response_class=HTMLResponse)
 async def home(request: Request):
+    # The node table is loaded page by page from /api/nodes
     try:
-        with open(DATA_CSV, mode='r') as file:
-            nodes = [row for row in csv.DictReader(file)]
-        with open(SELECTED_CSV, mode='r') as file:
-            selected = {row['node_id'] for row in csv.DictReader(file)}
         opcua_to_mqtt_status = "running" if is_process_running(OPCUA_TO_MQTT_SCRIPT) else "stopped"
         mqtt_to_influx_status = "running" if is_process_running(MQTT_TO_INFLUX_SCRIPT) else "stopped"
     except Exception as e:
-        logging.error(f"Error reading CSV files or getting converter status: {e}")
-        nodes, selected = [], set()
+        logging.error(f"Error getting converter status: {e}")
         opcua_to_mqtt_status = mqtt_to_influx_status = "unknown"
     return templates.TemplateResponse("index.html", {
         "request": request,
-        "nodes": nodes,
-        "selected": selected,
         "opcua_to_mqtt_status": opcua_to_mqtt_status,
         "mqtt_to_influx_status": mqtt_to_influx_status,
-        "read_interval": os.environ.get('READ_INTERVAL', '5')  # Add this line
+        "read_interval": read_converter_settings().get('read_interval', os.environ.get('READ_INTERVAL', '5'))
     })
 
+@app.get("/api/nodes")
+async def search_nodes(q: str = "", offset: int = 0, limit: int = 100, selected: bool = None):
+    limit = max(1, min(limit, 1000))
+    try:
+        total, items = catalog.search(q, max(0, offset), limit, selected)
+    except Exception as e:
+        logging.error(f"Error searching node catalog: {e}")
+        return JSONResponse(content={"error": "Failed to search nodes"}, status_code=500)
+    for item in items:
+        item["current"] = value_cache.get(published_node_id(item["node_id"]))
+    return {"total": total, "offset": offset, "limit": limit, "items": items}
+
+def export_chunks(export_format, q, selected):
+    # Produced batch by batch while the response is sent; Starlette runs this in a worker thread
+    if export_format == "ndjson":
+        for batch in catalog.iter_nodes(q, selected, NODE_EXPORT_BATCH_SIZE):
+            yield "".join(json.dumps(node) + "\n" for node in batch)
+        return
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(CATALOG_COLUMNS)
+    for batch in catalog.iter_nodes(q, selected, NODE_EXPORT_BATCH_SIZE):
+        writer.writerows([node[column] for column in CATALOG_COLUMNS] for node in batch)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+@app.get("/api/nodes/export")
+async def export_nodes(export_format: str = Query("csv", alias="format"), q: str = "", selected: bool = None):
+    # The whole catalog (or the nodes matching q/selected like /api/nodes) as a streamed download
+    if export_format not in NODE_EXPORT_MEDIA_TYPES:
+        return JSONResponse(content={"error": f"Unknown format: {export_format}"}, status_code=400)
+    return StreamingResponse(export_chunks(export_format, q, selected), media_type=NODE_EXPORT_MEDIA_TYPES[export_format],
+                             headers={"Content-Disposition": f'attachment; filename="nodes.{export_format}"'})
+
+def read_node_upload(filename, data):
+    # CSV with node_id (or NodeId, as in nodes_output.csv) and optional description and
+    # SETTINGS_COLUMNS, or NDJSON objects with the same keys for .ndjson/.jsonl files.
+    # Returns node id -> node (later rows win) and node id -> error.
+    text = data.decode('utf-8-sig')
+    if (filename or "").lower().endswith((".ndjson", ".jsonl")):
+        records = [json.loads(line) for line in text.splitlines() if line.strip()]
+    else:
+        records = list(csv.DictReader(io.StringIO(text)))
+    nodes, invalid = {}, {}
+    for record in records:
+        if not isinstance(record, dict):
+            raise ValueError("Every NDJSON line must be an object")
+        node_id = str(record.get('node_id') or record.get('NodeId') or '').strip()
+        if not node_id:
+            continue
+        node = {"node_id": node_id, "description": record.get('description') or record.get('Description') or None}
+        try:
+            for column in SETTINGS_COLUMNS:
+                value = record.get(column)
+                node[column] = None if value is None or value == "" else float(value)
+                if node[column] is not None and (node[column] < 0 or (column == "interval" and node[column] == 0)):
+                    raise ValueError(f"{column} {value}")
+        except (TypeError, ValueError) as e:
+            invalid[node_id] = f"Invalid setting: {e}"
+            nodes.pop(node_id, None)
+            continue
+        nodes[node_id] = node
+        invalid.pop(node_id, None)
+    return nodes, invalid
+
+async def read_server_node_rows(node_ids):
+    exporter = NodeCSVExporter()
+    try:
+        await exporter.connect()
+        return await exporter.read_node_rows(node_ids)
+    finally:
+        if exporter.client:
+            try:
+                await exporter.client.disconnect()
+            except Exception:
+                pass
+
+@app.post("/api/nodes/import")
+async def import_nodes(file: UploadFile = File(...), validate: bool = True, select: bool = False):
+    # Bulk add: the node ids are checked against the server in batched reads (only their
+    # syntax with validate=false) and the valid ones merged into the catalog in one transaction
+    try:
+        nodes, invalid = read_node_upload(file.filename, await file.read())
+    except (ValueError, csv.Error) as e:
+        return JSONResponse(content={"error": f"Could not read upload: {e}"}, status_code=400)
+    if len(nodes) > NODE_IMPORT_MAX:
+        return JSONResponse(content={"error": f"Too many nodes: {len(nodes)} (at most {NODE_IMPORT_MAX})"}, status_code=400)
+    merged = {}
+    if validate:
+        try:
+            rows, unknown = await read_server_node_rows(list(nodes))
+        except Exception as e:
+            logging.error(f"Error validating uploaded nodes: {e}")
+            return JSONResponse(content={"error": "Could not validate nodes against the OPC UA server"}, status_code=503)
+        for node_id, row in rows.items():
+            node = nodes[node_id]
+            merged[row[0]] = {**node, "node_id": row[0], "browse_name": row[1], "data_type": row[3],
+                              "display_name": row[4], "description": node["description"] or row[5]}
+    else:
+        parsed, unknown = parse_node_ids(list(nodes))
+        for node_id, nodeid in parsed.items():
+            merged[nodeid.to_string()] = {**nodes[node_id], "node_id": nodeid.to_string()}
+    invalid.update(unknown)
+    try:
+        added, updated = catalog.merge_nodes(list(merged.values()), select)
+        if select and merged:
+            apply_selection_change()
+    except Exception as e:
+        logging.error(f"Error importing nodes: {e}")
+        return JSONResponse(content={"error": "Failed to import nodes"}, status_code=500)
+    logging.info(f"Imported {len(merged)} nodes ({added} new, {updated} updated), {len(invalid)} rejected")
+    return {"added": added, "updated": updated, "invalid_count": len(invalid), "invalid": dict(list(invalid.items())[:100])}
+
+def apply_selection_change():
+    # The running converter watches selected.csv and adjusts its monitored items in place
+    catalog.write_selected_csv(SELECTED_CSV)
+
+@app.post("/api/selection")
+async def update_selection_delta(delta: SelectionDelta):
+    try:
+        added, removed = catalog.apply_selection(delta.add, delta.remove)
+        if added or removed:
+            apply_selection_change()
+            logging.info(f"Selection changed: {added} added, {removed} removed")
+        return {"added": added, "removed": removed, "selected_count": catalog.search(selected=True, limit=1)[0]}
+    except Exception as e:
+        logging.error(f"Error updating selection: {e}")
+        return JSONResponse(content={"error": "Failed to update selection"}, status_code=500)
+
+def invalid_node_settings(nodes):
+    return [node_id for node_id, settings in nodes.items()
+            if any(v is not None and v < 0 for v in settings.model_dump().values()) or settings.interval == 0]
+
+@app.post("/api/node_settings")
+async def update_node_settings(update: NodeSettingsUpdate):
+    invalid = invalid_node_settings(update.nodes)
+    if invalid:
+        return JSONResponse(content={"error": f"Invalid settings for {', '.join(invalid)}"}, status_code=400)
+    try:
+        catalog.set_node_settings({node_id: settings.model_dump(exclude_unset=True) for node_id, settings in update.nodes.items()})
+        apply_selection_change()
+        logging.info(f"Acquisition settings updated for {len(update.nodes)} nodes")
+        return {"updated": len(update.nodes)}
+    except Exception as e:
+        logging.error(f"Error updating node settings: {e}")
+        return JSONResponse(content={"error": "Failed to update node settings"}, status_code=500)
+
 @app.post("/add_node")
 async def add_node(node_id: str = Form(...), description: str = Form(...)):
     try:
+        catalog.add_node(node_id, description)
         with open(DATA_CSV, mode='a', newline='') as file:
             csv.writer(file).writerow([node_id, description])
         logging.info(f"Added new node: {node_id} - {description}")
@@ -150,19 +417,14 @@ async def add_node(node_id: str = Form(...), description: str = Form(...)):
 
 @app.post("/update")
 async def update_selected(request: UpdateRequest):
+    invalid = invalid_node_settings(request.node_settings)
+    if invalid:
+        return JSONResponse(content={"error": f"Invalid settings for {', '.join(invalid)}"}, status_code=400)
     try:
-        with open(DATA_CSV, mode='r') as file:
-            all_nodes = [row for row in csv.DictReader(file)]
-        selected_nodes = [node for node in all_nodes if node['node_id'] in request.node_ids]
-        with open(SELECTED_CSV, mode='w', newline='') as file:
-            writer = csv.DictWriter(file, fieldnames=["node_id", "description"])
-            writer.writeheader()
-            writer.writerows(selected_nodes)
-        if is_process_running(OPCUA_TO_MQTT_SCRIPT):
-            stop_script(OPCUA_TO_MQTT_SCRIPT)
-            await asyncio.sleep(1)
-            await start_script(OPCUA_TO_MQTT_SCRIPT)
-            logging.info("OPC UA to MQTT converter restarted with new node selection")
+        catalog.set_selection(request.node_ids)
+        catalog.set_node_settings({node_id: settings.model_dump(exclude_unset=True) for node_id, settings in request.node_settings.items()})
+        selected_nodes = [{key: node[key] for key in ("node_id", "description", "interval", "deadband", "deadband_pct")} for node in catalog.selected_nodes()]
+        apply_selection_change()
         logging.info(f"Selection updated. Selected nodes: {', '.join(request.node_ids)}" if request.node_ids else "Selection updated. No nodes selected.")
         return JSONResponse(content={"message": "Selection updated successfully" if request.node_ids else "All nodes deselected", "selected_nodes": selected_nodes})
     except Exception as e:
@@ -172,7 +434,7 @@ async def update_selected(request: UpdateRequest):
 @app.post("/clear_logs")
 async def clear_logs():
     try:
-        for log_file in [LOG_FILE, OPCUA_TO_MQTT_LOG_FILE, MQTT_TO_INFLUX_LOG_FILE]:
+        for log_file in LOG_FILES.values():
             open(log_file, 'w').close()
         return {"message": "All logs cleared successfully"}
     except Exception as e:
@@ -215,44 +477,146 @@ async def toggle_mqtt_to_influx():
 
 @app.get("/logs", response_class=HTMLResponse)
 async def get_logs(request: Request):
-    log_files = {"Application": LOG_FILE, "opcua_to_MQTT_Converter.py": OPCUA_TO_MQTT_LOG_FILE, "mqtt_to_Influx_Converter.py": MQTT_TO_INFLUX_LOG_FILE}
-    logs = {}
-    for script, log_file in log_files.items():
+    # Log contents are streamed by /logs/stream
+    return templates.TemplateResponse("logs.html", {"request": request, "logs": LOG_FILES})
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.get("/logs/stream")
+async def stream_logs(request: Request):
+    # Server-Sent Events: the last LOG_WINDOW lines of every log, then new lines as they are written
+    queue = log_tailer.subscribe()
+
+    async def events():
         try:
-            with open(log_file, mode="r") as file:
-                logs[script] = file.readlines()
-        except Exception as e:
-            logs[script] = [f"Error reading log file: {e}\n"]
-    return templates.TemplateResponse("logs.html", {"request": request, "logs": logs})
+            for script in LOG_FILES:
+                yield sse_event("lines", {"script": script, "lines": log_tailer.initial_lines(script, LOG_WINDOW)})
+            while not await request.is_disconnected():
+                try:
+                    event, script, lines = await asyncio.wait_for(queue.get(), LOG_STREAM_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield sse_event(event, {"script": script, "lines": lines[-LOG_WINDOW:]})
+        finally:
+            log_tailer.unsubscribe(queue)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+def value_nodes(nodes):
+    # published node id -> node id as the client asked for it
+    return None if nodes is None else {published_node_id(node_id): node_id for node_id in nodes}
+
+def requested_node_ids(values, node_map):
+    return values if node_map is None else {node_map[node]: entry for node, entry in values.items()}
+
+@app.get("/values")
+async def get_values(nodes: List[str] = Query(None), since: int = None):
+    # Latest value of every node (or of the nodes given), or only what changed after version `since`
+    node_map = value_nodes(nodes)
+    if since is None:
+        version, values = value_cache.snapshot(node_map)
+        reset = True
+    else:
+        version, values, reset = value_cache.changes_since(since, node_map)
+    return {"version": version, "reset": reset, "values": requested_node_ids(values, node_map)}
+
+@app.get("/values/stream")
+async def stream_values(request: Request, nodes: List[str] = Query(None), since: int = None):
+    # Server-Sent Events: a snapshot (or the changes after `since`), then the changes of every VALUE_STREAM_INTERVAL
+    node_map = value_nodes(nodes)
+
+    async def events():
+        version = -1 if since is None else since
+        idle = 0.0
+        while not await request.is_disconnected():
+            if version != value_cache.version:
+                if version < 0:
+                    current, values = value_cache.snapshot(node_map)
+                    reset = True
+                else:
+                    current, values, reset = value_cache.changes_since(version, node_map)
+                version = current
+                if values or reset:
+                    yield sse_event("values", {"version": version, "reset": reset,
+                                               "values": requested_node_ids(values, node_map)})
+                    idle = 0.0
+            if idle >= LOG_STREAM_KEEPALIVE:
+                yield ": keepalive\n\n"
+                idle = 0.0
+            await asyncio.sleep(VALUE_STREAM_INTERVAL)
+            idle += VALUE_STREAM_INTERVAL
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
 
 @app.get("/converter_status")
 async def get_converter_status():
-    return {"opcua_to_mqtt": "running" if is_process_running(OPCUA_TO_MQTT_SCRIPT) else "stopped", "mqtt_to_influx": "running" if is_process_running(MQTT_TO_INFLUX_SCRIPT) else "stopped"}
+    return {
+        "opcua_to_mqtt": "running" if is_process_running(OPCUA_TO_MQTT_SCRIPT) else "stopped",
+        "mqtt_to_influx": "running" if is_process_running(MQTT_TO_INFLUX_SCRIPT) else "stopped",
+        "opcua_to_mqtt_shards": [shard_status(shard) for shard in range(OPCUA_TO_MQTT_WORKERS)],
+        "mqtt_broker": mqtt_manager.status(),
+        "value_cache": value_cache.stats(),
+    }
+
+@app.get("/snapshot_status")
+async def get_snapshot_status():
+    snapshot = snapshot_refresher.snapshot if snapshot_refresher else None
+    return {
+        "version": snapshot["version"] if snapshot else None,
+        "created": snapshot["created"] if snapshot else None,
+        "nodes": len(snapshot["rows"]) if snapshot else 0,
+        "last_refresh": snapshot_refresher.last_refresh if snapshot_refresher else None,
+        "last_error": snapshot_refresher.last_error if snapshot_refresher else None,
+    }
+
+def pipeline_snapshots():
+    # The converters' latest dumps plus the supervisor's own view
+    web = PipelineMetrics("web")
+    web.set_gauge("opcua_to_mqtt_workers", OPCUA_TO_MQTT_WORKERS)
+    web.set_gauge("opcua_to_mqtt_workers_running", sum(process.returncode is None for process in script_processes(OPCUA_TO_MQTT_SCRIPT)))
+    web.set_gauge("mqtt_to_influx_running", 1 if is_process_running(MQTT_TO_INFLUX_SCRIPT) else 0)
+    web.set_gauge("mqtt_broker_connected", 1 if mqtt_manager.connected else 0)
+    web.set_total("mqtt_connects", mqtt_manager.connects)
+    cache_stats = value_cache.stats()
+    web.set_gauge("value_cache_nodes", cache_stats["nodes"])
+    for name in ("updates", "coalesced", "out_of_order", "rejected", "invalid_payloads"):
+        web.set_total(f"value_cache_{name}", cache_stats[name])
+    return load_snapshots() + [web.snapshot()]
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    # Prometheus text format
+    return PlainTextResponse(prometheus_text(pipeline_snapshots()), media_type="text/plain; version=0.0.4")
+
+@app.get("/metrics/status")
+async def get_metrics_status(stale_after: float = 60):
+    return status_view(pipeline_snapshots(), stale_after)
 
 @app.get("/test_mqtt")
 async def test_mqtt():
-    return {"message": "MQTT connection successful"} if test_mqtt_connection() else JSONResponse(content={"error": "MQTT connection failed"}, status_code=500)
+    # Answered from the shared connection's state, no new connection per request
+    status = mqtt_manager.status()
+    if status["connected"]:
+        return {"message": "MQTT connection successful", **status}
+    return JSONResponse(content={"error": "MQTT connection failed", **status}, status_code=500)
 
 @app.get("/get_latest_logs")
 async def get_latest_logs():
-    log_files = {"Application": LOG_FILE, "opcua_to_MQTT_Converter.py": OPCUA_TO_MQTT_LOG_FILE, "mqtt_to_Influx_Converter.py": MQTT_TO_INFLUX_LOG_FILE}
     latest_logs = {}
-    for script, log_file in log_files.items():
+    for script, log_file in LOG_FILES.items():
         try:
-            with open(log_file, mode="r") as file:
-                latest_logs[script] = file.readlines()[-100:][::-1]
+            latest_logs[script] = tail_lines(log_file, LOG_WINDOW)[::-1]
         except Exception as e:
             latest_logs[script] = [f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Error reading log file: {e}\n"]
     return latest_logs
 
 @app.post("/update_read_interval")
 async def update_read_interval(update: IntervalUpdate):
+    # Applied by the running converter without a restart
     os.environ['READ_INTERVAL'] = str(update.interval)
-    if is_process_running(OPCUA_TO_MQTT_SCRIPT):
-        stop_script(OPCUA_TO_MQTT_SCRIPT)
-        await asyncio.sleep(1)
-        await start_script(OPCUA_TO_MQTT_SCRIPT)
-        return {"message": f"Read interval updated to {update.interval} seconds and OPC UA to MQTT converter restarted"}
+    write_converter_settings(read_interval=update.interval)
     return {"message": f"Read interval updated to {update.interval} seconds"}
 
 @app.post("/toggle_both_converters")
@@ -261,8 +625,8 @@ async def toggle_both_converters(toggle: ConverterToggle):
     mqtt_running = is_process_running(MQTT_TO_INFLUX_SCRIPT)
 
     if toggle.turn_on:
-        if not opcua_running:
-            await start_script(OPCUA_TO_MQTT_SCRIPT)
+        # Also restarts OPC UA to MQTT workers that exited
+        await start_script(OPCUA_TO_MQTT_SCRIPT)
         if not mqtt_running:
             await start_script(MQTT_TO_INFLUX_SCRIPT)
         message = "Both converters turned on"
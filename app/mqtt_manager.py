@@ -0,0 +1,92 @@
+import logging
+import threading
+import time
+import paho.mqtt.client as mqtt
+
+# One long-lived MQTT connection for the web app. paho's network thread keeps it
+# up (connect_async + loop_start, reconnecting with backoff) and keepalive pings
+# notice a dead broker, so health checks answer from cached state instead of
+# opening a connection per request. Subscriptions made through the manager are
+# renewed on every reconnect.
+
+class MqttManager:
+    def __init__(self, host, port, keepalive=10, client_id=""):
+        self.host = host
+        self.port = port
+        self.keepalive = keepalive
+        self.client = mqtt.Client(client_id=client_id)
+        self.client.on_connect = self._on_connect
+        self.client.on_disconnect = self._on_disconnect
+        self.client.on_connect_fail = self._on_connect_fail
+        self.client.reconnect_delay_set(min_delay=1, max_delay=30)
+        self._subscriptions = {}  # topic -> qos
+        self._lock = threading.Lock()
+        self.connected = False
+        self.since = None  # time of the last state change
+        self.last_error = None
+        self.connects = 0
+        self.started = False
+
+    def start(self):
+        if not self.started:
+            self.client.connect_async(self.host, self.port, self.keepalive)
+            self.client.loop_start()
+            self.started = True
+
+    def stop(self):
+        if self.started:
+            self.client.disconnect()
+            self.client.loop_stop()
+            self.started = False
+
+    def _on_connect(self, client, userdata, flags, rc):
+        if rc != 0:
+            self.last_error = mqtt.connack_string(rc)
+            logging.error(f"MQTT connection refused: {self.last_error}")
+            return
+        self.connected = True
+        self.since = time.time()
+        self.connects += 1
+        with self._lock:
+            subscriptions = list(self._subscriptions.items())
+        if subscriptions:
+            client.subscribe(subscriptions)
+        logging.info(f"Connected to MQTT broker {self.host}:{self.port}")
+
+    def _on_connect_fail(self, client, userdata):
+        # Broker unreachable; paho keeps retrying with the reconnect delay
+        self.last_error = "Connection failed"
+
+    def _on_disconnect(self, client, userdata, rc):
+        self.connected = False
+        self.since = time.time()
+        if rc != 0:
+            self.last_error = mqtt.error_string(rc)
+            logging.warning(f"Lost connection to MQTT broker: {self.last_error}")
+
+    def subscribe(self, topic, callback, qos=0):
+        # callback(client, userdata, message) runs on paho's network thread
+        self.client.message_callback_add(topic, callback)
+        with self._lock:
+            self._subscriptions[topic] = qos
+        if self.connected:
+            self.client.subscribe(topic, qos)
+
+    def unsubscribe(self, topic):
+        self.client.message_callback_remove(topic)
+        with self._lock:
+            self._subscriptions.pop(topic, None)
+        if self.connected:
+            self.client.unsubscribe(topic)
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        return self.client.publish(topic, payload, qos, retain)
+
+    def status(self):
+        return {
+            "broker": f"{self.host}:{self.port}",
+            "connected": self.connected,
+            "since": self.since,
+            "last_error": self.last_error,
+            "connects": self.connects,
+        }
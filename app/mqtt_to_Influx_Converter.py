@@ -1,41 +1,368 @@
 import json
+import os
+import random
+import threading
+import time
+from collections import deque
 import paho.mqtt.client as mqtt
-from influxdb_client import InfluxDBClient, Point
+from influxdb_client import InfluxDBClient, Point, WritePrecision
 from influxdb_client.client.write_api import SYNCHRONOUS
+from influx_spool import SegmentSpool
+from payload_codec import decode_samples
+from aggregator import WindowAggregator, parse_windows
+from pipeline_metrics import METRICS_INTERVAL, PipelineMetrics
 
-MQTT_BROKER = "host.docker.internal"
-MQTT_PORT = 1883
+MQTT_BROKER = os.environ.get('MQTT_BROKER', "host.docker.internal")
+MQTT_PORT = int(os.environ.get('MQTT_PORT', 1883))
 MQTT_TOPIC = "plant1/#"
-INFLUXDB_URL = "host.docker.internal:8086"
-INFLUXDB_ORG = "PP_Test"
-INFLUXDB_BUCKET = "sensor_data"
+INFLUXDB_URL = os.environ.get('INFLUXDB_URL', "host.docker.internal:8086")
+INFLUXDB_ORG = os.environ.get('INFLUXDB_ORG', "PP_Test")
+INFLUXDB_BUCKET = os.environ.get('INFLUXDB_BUCKET', "sensor_data")
+# Samples the bridge read back from OPC UA history after an outage
+BACKFILL_TOPIC = os.environ.get('BACKFILL_TOPIC', 'plant1/_backfill')
+# Source timestamp of the newest acknowledged point per node; the bridge backfills from there
+WATERMARK_FILE = os.environ.get('WATERMARK_FILE', 'app/state/last_written.json')
 
-influx_client = InfluxDBClient(url=INFLUXDB_URL, org=INFLUXDB_ORG)
-write_api = influx_client.write_api(write_options=SYNCHRONOUS)
+# Batching write path: points are buffered by on_message and written by a background thread
+BATCH_SIZE = int(os.environ.get('INFLUX_BATCH_SIZE', 5000))
+FLUSH_INTERVAL = float(os.environ.get('INFLUX_FLUSH_INTERVAL', 1.0))  # s
+JITTER_INTERVAL = float(os.environ.get('INFLUX_JITTER_INTERVAL', 0.2))  # s, added to each flush deadline
+MAX_RETRIES = int(os.environ.get('INFLUX_MAX_RETRIES', 5))
+RETRY_INTERVAL = float(os.environ.get('INFLUX_RETRY_INTERVAL', 1.0))  # s, first backoff
+MAX_RETRY_INTERVAL = float(os.environ.get('INFLUX_MAX_RETRY_INTERVAL', 30.0))  # s
+EXPONENTIAL_BASE = float(os.environ.get('INFLUX_EXPONENTIAL_BASE', 2))
+MAX_BUFFERED = int(os.environ.get('INFLUX_MAX_BUFFERED', 200000))
+STATS_INTERVAL = int(os.environ.get('STATS_INTERVAL', 10))
+
+# Write-ahead spool for batches InfluxDB couldn't take, replayed once it recovers
+SPOOL_ENABLED = os.environ.get('INFLUX_SPOOL_ENABLED', 'true').lower() == 'true'
+SPOOL_DIR = os.environ.get('INFLUX_SPOOL_DIR', 'app/spool')
+SPOOL_SEGMENT_BYTES = int(os.environ.get('INFLUX_SPOOL_SEGMENT_BYTES', 16 * 1024 * 1024))
+SPOOL_MAX_BYTES = int(os.environ.get('INFLUX_SPOOL_MAX_BYTES', 1024 * 1024 * 1024))
+SPOOL_FSYNC = os.environ.get('INFLUX_SPOOL_FSYNC', 'false').lower() == 'true'
+SPOOL_BACKLOG_POINTS = int(os.environ.get('INFLUX_SPOOL_BACKLOG_POINTS', 50000))  # buffered points before spilling
+SPOOL_REPLAY_BATCH_SIZE = int(os.environ.get('INFLUX_SPOOL_REPLAY_BATCH_SIZE', 5000))
+SPOOL_REPLAY_RATE = float(os.environ.get('INFLUX_SPOOL_REPLAY_RATE', 20000))  # points/s
+
+# Optional downsampling: min/max/mean/last/count per node and window (s) into a
+# separate measurement, alongside the raw sensor_data points or instead of them
+AGGREGATE_WINDOWS = parse_windows(os.environ.get('AGGREGATE_WINDOWS', ''))  # e.g. "1,10,60"; empty disables
+AGGREGATE_MEASUREMENT = os.environ.get('AGGREGATE_MEASUREMENT', 'sensor_data_agg')
+AGGREGATE_SLOTS = int(os.environ.get('AGGREGATE_SLOTS', 4))  # open windows per node and window length
+AGGREGATE_GRACE = float(os.environ.get('AGGREGATE_GRACE', 2.0))  # s without samples before a window is closed
+RAW_WRITES = os.environ.get('RAW_WRITES', 'true').lower() == 'true'
+
+metrics = PipelineMetrics("mqtt_to_influx")
+
+class InfluxBatchWriter:
+    # write() only appends to an in-memory buffer, so the MQTT network loop never
+    # waits on HTTP. A writer thread flushes when BATCH_SIZE points are buffered or
+    # the (jittered) flush interval expires, retrying with exponential backoff.
+    # With a spool, batches that still fail and buffer backlog above
+    # SPOOL_BACKLOG_POINTS go to disk instead; while InfluxDB is unhealthy every
+    # batch is spooled, and a replay thread drains the spool at a bounded rate.
+    # Buffer entries are (point, source timestamp in ns or None, node or None,
+    # backfilled). Once InfluxDB acknowledged, the timestamp feeds the
+    # source-to-write latency histogram (live samples only) and the node's
+    # last written timestamp.
+    def __init__(self, write_api, bucket, org, spool=None):
+        self.write_api = write_api
+        self.bucket = bucket
+        self.org = org
+        self.spool = spool
+        self.healthy = True
+        self._buffer = deque()
+        self._condition = threading.Condition()
+        self._stopping = False
+        self.buffered = 0
+        self.flushed = 0
+        self.retried = 0
+        self.dropped = 0
+        self.replayed = 0
+        self.last_written = {}  # node -> source timestamp (ns)
+        self._last_written_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="influx-writer", daemon=True)
+        self._replay_thread = threading.Thread(target=self._replay_run, name="influx-spool-replay", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        if self.spool:
+            self._replay_thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        self._thread.join()
+
+    def pending(self):
+        return len(self._buffer)
+
+    def write(self, point, source_ns=None, node=None, backfill=False):
+        with self._condition:
+            if len(self._buffer) >= MAX_BUFFERED:
+                self._buffer.popleft()
+                self.dropped += 1
+            self._buffer.append((point, source_ns, node, backfill))
+            self.buffered += 1
+            if len(self._buffer) >= BATCH_SIZE:
+                self._condition.notify()
+
+    def _next_flush_deadline(self):
+        return time.monotonic() + FLUSH_INTERVAL + random.uniform(0, JITTER_INTERVAL)
+
+    def _run(self):
+        deadline = self._next_flush_deadline()
+        while True:
+            with self._condition:
+                self._condition.wait_for(
+                    lambda: self._stopping or len(self._buffer) >= BATCH_SIZE,
+                    timeout=max(0.0, deadline - time.monotonic()))
+                batch = [self._buffer.popleft() for _ in range(min(BATCH_SIZE, len(self._buffer)))]
+                stopping = self._stopping and not self._buffer
+            if batch:
+                self._write_with_retry(batch)
+            if self.spool:
+                self._spill_backlog()
+            if stopping:
+                return
+            if not batch or time.monotonic() >= deadline:
+                deadline = self._next_flush_deadline()
+
+    def _spill_backlog(self):
+        with self._condition:
+            excess = len(self._buffer) - SPOOL_BACKLOG_POINTS
+            spilled = [self._buffer.popleft() for _ in range(max(0, excess))]
+        if spilled:
+            self._spool_batch(spilled)
+
+    def _spool_batch(self, batch):
+        try:
+            self.spool.append([entry[0].to_line_protocol() for entry in batch])
+            return True
+        except Exception as e:
+            print(f"Error spooling batch of {len(batch)} points, dropping: {e}")
+            self.dropped += len(batch)
+            return False
+
+    def _write_with_retry(self, batch):
+        if self.spool and not self.healthy:
+            return self._spool_batch(batch)
+        delay = RETRY_INTERVAL
+        for attempt in range(MAX_RETRIES + 1):
+            try:
+                self.write_api.write(bucket=self.bucket, org=self.org, record=[entry[0] for entry in batch], write_precision=WritePrecision.NS)
+                acknowledged_ns = time.time_ns()
+                metrics.observe("source_to_write_seconds", [(acknowledged_ns - source_ns) / 1e9
+                                                            for _, source_ns, _, backfill in batch if source_ns and not backfill])
+                self._mark_written(batch)
+                self.flushed += len(batch)
+                self.healthy = True
+                return True
+            except Exception as e:
+                status = getattr(e, 'status', None)
+                # Client errors other than throttling won't succeed on a retry
+                retryable = not (isinstance(status, int) and 400 <= status < 500 and status != 429)
+                if not retryable or attempt == MAX_RETRIES:
+                    if retryable and self.spool:
+                        print(f"Error writing batch of {len(batch)} points, spooling: {e}")
+                        self.healthy = False
+                        return self._spool_batch(batch)
+                    print(f"Error writing batch of {len(batch)} points, dropping: {e}")
+                    break
+                self.retried += 1
+                sleep_for = min(delay, MAX_RETRY_INTERVAL) * random.uniform(0.5, 1.0)
+                print(f"Error writing batch of {len(batch)} points, retrying in {sleep_for:.1f} s: {e}")
+                time.sleep(sleep_for)
+                delay *= EXPONENTIAL_BASE
+        self.dropped += len(batch)
+        return False
+
+    def _mark_written(self, batch):
+        with self._last_written_lock:
+            for _, source_ns, node, _ in batch:
+                if node and source_ns and source_ns > self.last_written.get(node, 0):
+                    self.last_written[node] = source_ns
+
+    def save_last_written(self, path=WATERMARK_FILE):
+        # Points replayed from the spool don't move these; the bridge may backfill them again, which overwrites them
+        with self._last_written_lock:
+            last_written = dict(self.last_written)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, mode='w') as file:
+            json.dump(last_written, file)
+        os.replace(tmp_path, path)
+
+    def load_last_written(self, path=WATERMARK_FILE):
+        try:
+            with open(path, mode='r') as file:
+                self.last_written.update(json.load(file))
+        except (OSError, ValueError):
+            pass
+
+    def _replay_run(self):
+        delay = RETRY_INTERVAL
+        while True:
+            position, lines = self.spool.read_chunk(SPOOL_REPLAY_BATCH_SIZE)
+            if position is None:
+                time.sleep(1)
+                continue
+            started = time.monotonic()
+            if lines:
+                try:
+                    self.write_api.write(bucket=self.bucket, org=self.org, record=lines, write_precision=WritePrecision.NS)
+                except Exception as e:
+                    status = getattr(e, 'status', None)
+                    if isinstance(status, int) and 400 <= status < 500 and status != 429:
+                        print(f"Spooled batch of {len(lines)} points rejected, skipping: {e}")
+                        self.dropped += len(lines)
+                        self.spool.commit(position)
+                        continue
+                    self.healthy = False
+                    time.sleep(min(delay, MAX_RETRY_INTERVAL))
+                    delay *= EXPONENTIAL_BASE
+                    continue
+                self.replayed += len(lines)
+                self.healthy = True
+                delay = RETRY_INTERVAL
+            self.spool.commit(position)
+            time.sleep(max(0.0, len(lines) / SPOOL_REPLAY_RATE - (time.monotonic() - started)))
+
+    def stats(self):
+        stats = {"buffered": self.buffered, "flushed": self.flushed, "retried": self.retried,
+                 "dropped": self.dropped, "pending": self.pending(), "healthy": self.healthy}
+        if self.spool:
+            stats.update({"spooled": self.spool.spooled, "replayed": self.replayed,
+                          "spool_dropped": self.spool.dropped, "spool_bytes": self.spool.size_bytes()})
+        return stats
 
 def on_connect(client, userdata, flags, rc):
     print("Connected to MQTT Broker" if rc == 0 else f"Connection failed, rc: {rc}")
+    metrics.inc("mqtt_connects" if rc == 0 else "mqtt_connect_failures")
     client.subscribe(MQTT_TOPIC)
 
+class MessageHandler:
+    # userdata of the MQTT client: writes raw points and feeds the aggregator
+    def __init__(self, writer, aggregator=None):
+        self.writer = writer
+        self.aggregator = aggregator
+
+    def emit_aggregate(self, sensor_name, window, start_ns, count, minimum, maximum, mean, last):
+        point = (Point(AGGREGATE_MEASUREMENT).tag("sensor", sensor_name).tag("window", window)
+                 .field("min", minimum).field("max", maximum).field("mean", mean).field("last", last)
+                 .field("count", count).time(start_ns, WritePrecision.NS))
+        self.writer.write(point)
+
 def on_message(client, userdata, msg):
     try:
-        data = json.loads(msg.payload.decode().replace("'", '"'))
-        sensor_name = data.get("node_id", "unknown_sensor")
-        sensor_value = float(data.get("value", 0))
-        
-        point = Point("sensor_data").tag("sensor", sensor_name).field("value", sensor_value)
-        write_api.write(bucket=INFLUXDB_BUCKET, org=INFLUXDB_ORG, record=point)
-        print(f"Data written: {sensor_name} = {sensor_value}")
+        samples = decode_samples(msg.payload)
     except Exception as e:
         print(f"Error processing message: {e}")
+        metrics.inc("decode_errors")
+        return
+    received_ns = time.time_ns()
+    backfill = msg.topic == BACKFILL_TOPIC
+    metrics.inc("messages_received")
+    metrics.inc("backfill_samples_received" if backfill else "samples_received", len(samples))
+    for sensor_name, value, timestamp_ns, _ in samples:
+        try:
+            sensor_value = float(value)
+            # Source timestamp when the publisher sends one, otherwise receipt time,
+            # so spooled and replayed points keep their original time
+            # Backfilled samples are written raw even with RAW_WRITES=false, the aggregator can't take them
+            if RAW_WRITES or backfill:
+                point = Point("sensor_data").tag("sensor", sensor_name).field("value", sensor_value).time(timestamp_ns or received_ns, WritePrecision.NS)
+                userdata.writer.write(point, timestamp_ns, sensor_name, backfill)
+            if backfill:
+                # Too old for the aggregator's open windows, and not news for the freshness metrics
+                continue
+            if userdata.aggregator:
+                userdata.aggregator.add(sensor_name, sensor_value, timestamp_ns or received_ns)
+            metrics.seen(sensor_name, (timestamp_ns or received_ns) / 1e9)
+            print(f"Data buffered: {sensor_name} = {sensor_value}")
+        except Exception as e:
+            print(f"Error processing sample {sensor_name}: {e}")
+            metrics.inc("sample_errors")
+
+def flush_aggregates(aggregator):
+    while True:
+        time.sleep(1)
+        aggregator.flush_idle()
 
-mqtt_client = mqtt.Client()
-mqtt_client.on_connect = on_connect
-mqtt_client.on_message = on_message
+def dump_metrics(writer, aggregator):
+    while True:
+        time.sleep(METRICS_INTERVAL)
+        stats = writer.stats()
+        metrics.set_total("points_written", stats["flushed"])
+        metrics.set_total("write_retries", stats["retried"])
+        metrics.set_total("points_dropped", stats["dropped"])
+        metrics.set_gauge("writer_pending", stats["pending"])
+        metrics.set_gauge("influx_healthy", 1 if stats["healthy"] else 0)
+        if writer.spool:
+            metrics.set_total("points_spooled", stats["spooled"])
+            metrics.set_total("points_replayed", stats["replayed"])
+            metrics.set_gauge("spool_bytes", stats["spool_bytes"])
+        if aggregator:
+            metrics.set_total("aggregate_windows_written", aggregator.emitted)
+            metrics.set_total("aggregate_late_samples", aggregator.late)
+        try:
+            metrics.dump()
+            writer.save_last_written()
+        except OSError as e:
+            print(f"Error writing metrics: {e}")
+
+def report_stats(writer, aggregator):
+    while True:
+        time.sleep(STATS_INTERVAL)
+        stats = writer.stats()
+        print(f"Influx writer: {stats['buffered']} buffered, {stats['flushed']} flushed, {stats['retried']} retried, "
+              f"{stats['dropped']} dropped, {stats['pending']} pending")
+        if writer.spool:
+            print(f"Influx spool: {stats['spooled']} spooled, {stats['replayed']} replayed, {stats['spool_dropped']} dropped, "
+                  f"{stats['spool_bytes']} bytes on disk, influx {'healthy' if stats['healthy'] else 'unhealthy'}")
+        if aggregator:
+            print(f"Aggregator: {aggregator.aggregated} samples aggregated, {aggregator.emitted} windows written, "
+                  f"{aggregator.late} late samples dropped")
+
+def main():
+    influx_client = InfluxDBClient(url=INFLUXDB_URL, org=INFLUXDB_ORG)
+    spool = SegmentSpool(SPOOL_DIR, SPOOL_SEGMENT_BYTES, SPOOL_MAX_BYTES, SPOOL_FSYNC) if SPOOL_ENABLED else None
+    writer = InfluxBatchWriter(influx_client.write_api(write_options=SYNCHRONOUS), INFLUXDB_BUCKET, INFLUXDB_ORG, spool)
+    writer.load_last_written()
+    writer.start()
+    handler = MessageHandler(writer)
+    if AGGREGATE_WINDOWS:
+        handler.aggregator = WindowAggregator(AGGREGATE_WINDOWS, handler.emit_aggregate, AGGREGATE_SLOTS, AGGREGATE_GRACE)
+        threading.Thread(target=flush_aggregates, args=(handler.aggregator,), daemon=True).start()
+        print(f"Aggregating {', '.join(f'{w} s' for w in AGGREGATE_WINDOWS)} windows into {AGGREGATE_MEASUREMENT}"
+              f"{'' if RAW_WRITES else ', raw writes disabled'}")
+    elif not RAW_WRITES:
+        raise ValueError("RAW_WRITES=false needs AGGREGATE_WINDOWS, nothing would be written")
+    threading.Thread(target=report_stats, args=(writer, handler.aggregator), daemon=True).start()
+    threading.Thread(target=dump_metrics, args=(writer, handler.aggregator), daemon=True).start()
+
+    mqtt_client = mqtt.Client(userdata=handler)
+    mqtt_client.on_connect = on_connect
+    mqtt_client.on_message = on_message
+
+    try:
+        print("Connecting to MQTT Broker...")
+        mqtt_client.connect(MQTT_BROKER, MQTT_PORT)
+        mqtt_client.loop_forever()
+    except KeyboardInterrupt:
+        print("Stopping...")
+    except Exception as e:
+        print(f"Error: {e}")
+    finally:
+        if handler.aggregator:
+            handler.aggregator.flush_idle(force=True)
+        writer.stop()
+        try:
+            writer.save_last_written()
+        except OSError as e:
+            print(f"Error saving last written timestamps: {e}")
+        influx_client.close()
 
-try:
-    print("Connecting to MQTT Broker...")
-    mqtt_client.connect(MQTT_BROKER, MQTT_PORT)
-    mqtt_client.loop_forever()
-except Exception as e:
-    print(f"Error: {e}")
\ No newline at end of file
+if __name__ == "__main__":
+    main()
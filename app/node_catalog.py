@@ -0,0 +1,238 @@
+import csv
+import os
+import re
+import sqlite3
+import threading
+
+# SQLite store behind the node selection UI. Browsed nodes are synced in from the
+# address space snapshot (source 'browse'), nodes added by hand are kept across
+# refreshes (source 'manual'). Search uses an FTS5 index over node id, browse name
+# and description when the SQLite build has it, and falls back to LIKE otherwise.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS nodes (
+    node_id TEXT PRIMARY KEY,
+    browse_name TEXT NOT NULL DEFAULT '',
+    display_name TEXT NOT NULL DEFAULT '',
+    description TEXT NOT NULL DEFAULT '',
+    data_type TEXT NOT NULL DEFAULT '',
+    parent_id TEXT NOT NULL DEFAULT '',
+    source TEXT NOT NULL DEFAULT 'browse',
+    selected INTEGER NOT NULL DEFAULT 0,
+    interval REAL,
+    deadband REAL,
+    deadband_pct REAL
+);
+CREATE INDEX IF NOT EXISTS nodes_selected ON nodes (selected, node_id);
+"""
+
+FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS nodes_fts USING fts5(
+    node_id, browse_name, description, content='nodes', content_rowid='rowid'
+);
+CREATE TRIGGER IF NOT EXISTS nodes_fts_insert AFTER INSERT ON nodes BEGIN
+    INSERT INTO nodes_fts (rowid, node_id, browse_name, description)
+    VALUES (new.rowid, new.node_id, new.browse_name, new.description);
+END;
+CREATE TRIGGER IF NOT EXISTS nodes_fts_delete AFTER DELETE ON nodes BEGIN
+    INSERT INTO nodes_fts (nodes_fts, rowid, node_id, browse_name, description)
+    VALUES ('delete', old.rowid, old.node_id, old.browse_name, old.description);
+END;
+CREATE TRIGGER IF NOT EXISTS nodes_fts_update AFTER UPDATE OF node_id, browse_name, description ON nodes BEGIN
+    INSERT INTO nodes_fts (nodes_fts, rowid, node_id, browse_name, description)
+    VALUES ('delete', old.rowid, old.node_id, old.browse_name, old.description);
+    INSERT INTO nodes_fts (rowid, node_id, browse_name, description)
+    VALUES (new.rowid, new.node_id, new.browse_name, new.description);
+END;
+"""
+
+# Per-node acquisition settings, written to selected.csv; NULL means the bridge default.
+# interval is the poll interval in s, deadband an absolute value change and
+# deadband_pct a change relative to the last published value.
+SETTINGS_COLUMNS = ("interval", "deadband", "deadband_pct")
+COLUMNS = ("node_id", "browse_name", "display_name", "description", "data_type", "parent_id", "source", "selected") + SETTINGS_COLUMNS
+
+def fts_query(text):
+    # Every word must match as a prefix, punctuation is treated like the tokenizer does
+    tokens = re.findall(r"\w+", text)
+    return " ".join(f'"{token}"*' for token in tokens)
+
+class NodeCatalog:
+    def __init__(self, path):
+        self._lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+        # Catalogs created before the settings columns existed
+        existing = {row["name"] for row in self.db.execute("PRAGMA table_info(nodes)")}
+        for column in SETTINGS_COLUMNS:
+            if column not in existing:
+                self.db.execute(f"ALTER TABLE nodes ADD COLUMN {column} REAL")
+        try:
+            self.db.executescript(FTS_SCHEMA)
+            self.has_fts = True
+        except sqlite3.OperationalError:
+            self.has_fts = False
+        self.db.commit()
+
+    def count(self):
+        with self._lock:
+            return self.db.execute("SELECT count(*) FROM nodes").fetchone()[0]
+
+    def sync_browsed(self, rows):
+        # rows are NodeCsvExporter rows: NodeId, BrowseName, ParentNodeId, DataType, DisplayName, Description.
+        # Browsed nodes that disappeared are removed unless they are selected.
+        with self._lock, self.db:
+            self.db.execute("CREATE TEMP TABLE IF NOT EXISTS browsed (node_id TEXT PRIMARY KEY)")
+            self.db.execute("DELETE FROM browsed")
+            self.db.executemany("INSERT OR IGNORE INTO browsed (node_id) VALUES (?)", ((row[0],) for row in rows))
+            self.db.executemany("""
+                INSERT INTO nodes (node_id, browse_name, parent_id, data_type, display_name, description, source)
+                VALUES (?, ?, ?, ?, ?, ?, 'browse')
+                ON CONFLICT (node_id) DO UPDATE SET
+                    browse_name = excluded.browse_name, parent_id = excluded.parent_id, data_type = excluded.data_type,
+                    display_name = excluded.display_name, description = excluded.description, source = 'browse'
+                WHERE browse_name != excluded.browse_name OR parent_id != excluded.parent_id
+                    OR data_type != excluded.data_type OR display_name != excluded.display_name
+                    OR description != excluded.description OR source != 'browse'
+            """, (tuple(row[:6]) for row in rows))
+            self.db.execute("""
+                DELETE FROM nodes WHERE source = 'browse' AND selected = 0
+                    AND node_id NOT IN (SELECT node_id FROM browsed)
+            """)
+
+    def import_csv(self, data_csv, selected_csv):
+        # One-off migration of the CSV files the UI used before the catalog existed
+        with self._lock, self.db:
+            try:
+                with open(data_csv, mode='r') as file:
+                    self.db.executemany(
+                        "INSERT OR IGNORE INTO nodes (node_id, description, source) VALUES (?, ?, 'manual')",
+                        ((row['node_id'], row.get('description') or '') for row in csv.DictReader(file) if row.get('node_id')))
+                with open(selected_csv, mode='r') as file:
+                    self.db.executemany(
+                        "UPDATE nodes SET selected = 1, interval = ?, deadband = ?, deadband_pct = ? WHERE node_id = ?",
+                        ([float(row[c]) if row.get(c) else None for c in SETTINGS_COLUMNS] + [row['node_id']]
+                         for row in csv.DictReader(file) if row.get('node_id')))
+            except OSError:
+                pass
+
+    def add_node(self, node_id, description):
+        with self._lock, self.db:
+            self.db.execute("""
+                INSERT INTO nodes (node_id, description, source) VALUES (?, ?, 'manual')
+                ON CONFLICT (node_id) DO UPDATE SET description = excluded.description
+            """, (node_id, description))
+
+    def _filters(self, query, selected):
+        where, params = [], []
+        if query and self.has_fts:
+            where.append("rowid IN (SELECT rowid FROM nodes_fts WHERE nodes_fts MATCH ?)")
+            params.append(fts_query(query) or '""')
+        elif query:
+            where.append("(node_id LIKE ? OR browse_name LIKE ? OR description LIKE ?)")
+            params.extend([f"%{query}%"] * 3)
+        if selected is not None:
+            where.append("selected = ?")
+            params.append(1 if selected else 0)
+        return where, params
+
+    def search(self, query="", offset=0, limit=100, selected=None):
+        where, params = self._filters(query, selected)
+        clause = f"WHERE {' AND '.join(where)}" if where else ""
+        with self._lock:
+            total = self.db.execute(f"SELECT count(*) FROM nodes {clause}", params).fetchone()[0]
+            rows = self.db.execute(f"SELECT {', '.join(COLUMNS)} FROM nodes {clause} ORDER BY node_id LIMIT ? OFFSET ?",
+                                   params + [limit, offset]).fetchall()
+        return total, [dict(row) for row in rows]
+
+    def iter_nodes(self, query="", selected=None, batch_size=1000):
+        # Every matching node in node_id order, in batches read by key rather than by
+        # offset; the lock is only held per batch, not while the caller consumes it
+        where, params = self._filters(query, selected)
+        last = None
+        while True:
+            conditions, values = list(where), list(params)
+            if last is not None:
+                conditions.append("node_id > ?")
+                values.append(last)
+            clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+            with self._lock:
+                rows = self.db.execute(f"SELECT {', '.join(COLUMNS)} FROM nodes {clause} ORDER BY node_id LIMIT ?",
+                                       values + [batch_size]).fetchall()
+            if not rows:
+                return
+            yield [dict(row) for row in rows]
+            if len(rows) < batch_size:
+                return
+            last = rows[-1]["node_id"]
+
+    def merge_nodes(self, nodes, select=False):
+        # Bulk add in one transaction. nodes are dicts with node_id and any of
+        # browse_name, display_name, description, data_type, parent_id and the
+        # SETTINGS_COLUMNS; None keeps the stored value. New nodes count as added by hand.
+        # Returns (added, updated).
+        attributes = ("browse_name", "display_name", "description", "data_type", "parent_id") + SETTINGS_COLUMNS
+        groups = {}  # columns given -> rows of values
+        for node in nodes:
+            columns = tuple(column for column in attributes if node.get(column) is not None)
+            groups.setdefault(columns, []).append([node[column] for column in columns] + [node["node_id"]])
+        with self._lock, self.db:
+            added = self.db.executemany("INSERT OR IGNORE INTO nodes (node_id, source) VALUES (?, 'manual')",
+                                        ((node["node_id"],) for node in nodes)).rowcount
+            for columns, rows in groups.items():
+                if columns:
+                    self.db.executemany(f"UPDATE nodes SET {', '.join(f'{c} = ?' for c in columns)} WHERE node_id = ?", rows)
+            if select:
+                self.db.executemany("UPDATE nodes SET selected = 1 WHERE node_id = ?", ((node["node_id"],) for node in nodes))
+        return added, len(nodes) - added
+
+    def apply_selection(self, add=(), remove=()):
+        # Returns how many rows actually changed state in each direction
+        with self._lock, self.db:
+            added = self.db.executemany("UPDATE nodes SET selected = 1 WHERE node_id = ? AND selected = 0",
+                                        ((node_id,) for node_id in add)).rowcount
+            removed = self.db.executemany("UPDATE nodes SET selected = 0 WHERE node_id = ? AND selected = 1",
+                                          ((node_id,) for node_id in remove)).rowcount
+        return added, removed
+
+    def set_selection(self, node_ids):
+        with self._lock, self.db:
+            self.db.execute("UPDATE nodes SET selected = 0 WHERE selected = 1")
+            self.db.executemany("UPDATE nodes SET selected = 1 WHERE node_id = ?", ((node_id,) for node_id in node_ids))
+
+    def set_node_settings(self, settings):
+        # settings: node id -> {column: value or None} for the SETTINGS_COLUMNS to change
+        with self._lock, self.db:
+            for node_id, values in settings.items():
+                columns = [column for column in SETTINGS_COLUMNS if column in values]
+                if columns:
+                    self.db.execute(f"UPDATE nodes SET {', '.join(f'{c} = ?' for c in columns)} WHERE node_id = ?",
+                                    [values[c] for c in columns] + [node_id])
+
+    def selected_nodes(self):
+        with self._lock:
+            rows = self.db.execute(f"SELECT {', '.join(COLUMNS)} FROM nodes WHERE selected = 1 ORDER BY node_id").fetchall()
+        return [dict(row) for row in rows]
+
+    def write_selected_csv(self, selected_csv):
+        # Replaced atomically, the converter may be reading it. Extra per-node
+        # columns (sampling_interval, queue_size, ...) edited by hand are kept.
+        fieldnames, existing = ["node_id", "description", *SETTINGS_COLUMNS], {}
+        try:
+            with open(selected_csv, mode='r', newline='') as file:
+                reader = csv.DictReader(file)
+                fieldnames += [f for f in reader.fieldnames or [] if f not in fieldnames]
+                existing = {row['node_id']: row for row in reader if row.get('node_id')}
+        except OSError:
+            pass
+        tmp_file = selected_csv + ".tmp"
+        with open(tmp_file, mode='w', newline='') as file:
+            writer = csv.DictWriter(file, fieldnames=fieldnames, extrasaction='ignore')
+            writer.writeheader()
+            for node in self.selected_nodes():
+                row = {**existing.get(node['node_id'], {}), "node_id": node['node_id'], "description": node['description']}
+                row.update({column: "" if node[column] is None else node[column] for column in SETTINGS_COLUMNS})
+                writer.writerow(row)
+        os.replace(tmp_file, selected_csv)
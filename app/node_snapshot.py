@@ -0,0 +1,211 @@
+import asyncio
+import csv
+import hashlib
+import json
+import logging
+import os
+from datetime import datetime, timezone
+from asyncua import ua
+from .NodeCsvExporter import NodeCSVExporter, OPC_SERVER_URL, CSV_COLUMNS
+
+# Browse results are kept as versioned JSON snapshots, one per server identity
+# (server URI + namespace array), so the UI can start from the last known address
+# space while the server is re-checked in the background.
+SNAPSHOT_DIR = os.environ.get('SNAPSHOT_DIR', 'app/snapshots')
+SNAPSHOT_INDEX = os.path.join(SNAPSHOT_DIR, "index.json")
+SNAPSHOT_FORMAT = 1
+RETRY_DELAY = int(os.environ.get('SNAPSHOT_RETRY_DELAY', 30))
+WATCHDOG_INTERVAL = int(os.environ.get('SNAPSHOT_WATCHDOG_INTERVAL', 10))
+MODEL_CHANGE_DEBOUNCE = float(os.environ.get('MODEL_CHANGE_DEBOUNCE', 2))
+
+NODE_ADDED = 1
+NODE_DELETED = 2
+
+def snapshot_key(server_uri, namespaces):
+    return hashlib.sha1(json.dumps([server_uri, list(namespaces)]).encode()).hexdigest()
+
+def snapshot_path(key):
+    return os.path.join(SNAPSHOT_DIR, f"{key}.json")
+
+def write_json_atomic(path, data):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, mode='w', encoding='utf-8') as file:
+        json.dump(data, file)
+    os.replace(tmp_path, path)
+
+def load_latest_snapshot(endpoint=OPC_SERVER_URL):
+    try:
+        with open(SNAPSHOT_INDEX, mode='r') as file:
+            key = json.load(file)[endpoint]
+        with open(snapshot_path(key), mode='r', encoding='utf-8') as file:
+            snapshot = json.load(file)
+    except (OSError, ValueError, KeyError):
+        return None
+    return snapshot if snapshot.get("format") == SNAPSHOT_FORMAT else None
+
+def save_snapshot(snapshot, endpoint=OPC_SERVER_URL):
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    write_json_atomic(snapshot_path(snapshot["key"]), snapshot)
+    try:
+        with open(SNAPSHOT_INDEX, mode='r') as file:
+            index = json.load(file)
+    except (OSError, ValueError):
+        index = {}
+    index[endpoint] = snapshot["key"]
+    write_json_atomic(SNAPSHOT_INDEX, index)
+
+def write_nodes_output_csv(snapshot, output_file):
+    with open(output_file, 'w', newline='', encoding='utf-8') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(CSV_COLUMNS)
+        writer.writerows(snapshot["rows"])
+
+def node_version_properties(rows):
+    # parent node id -> NodeVersion property node id
+    return {row[2]: row[0] for row in rows if row[1].split(":", 1)[-1] == "NodeVersion" and row[2]}
+
+def remove_subtrees(rows_by_id, node_ids):
+    children = {}
+    for row in rows_by_id.values():
+        children.setdefault(row[2], []).append(row[0])
+    pending = list(node_ids)
+    while pending:
+        for child in children.get(pending.pop(), []):
+            if rows_by_id.pop(child, None) is not None:
+                pending.append(child)
+
+class SnapshotRefresher:
+    # Keeps the snapshot in sync with the server. On every (re)connect it either
+    # re-browses only the subtrees whose NodeVersion changed (when the snapshot
+    # belongs to the same server and the server exposes NodeVersion) or the whole
+    # tree. While connected it follows GeneralModelChangeEvents and re-browses the
+    # affected subtrees. on_update(snapshot) is called whenever a new version is saved.
+    def __init__(self, snapshot, on_update):
+        self.snapshot = snapshot
+        self.on_update = on_update
+        self.last_refresh = None
+        self.last_error = None
+        self._changed = set()
+        self._full_refresh = False
+        self._change_event = asyncio.Event()
+
+    async def run(self):
+        while True:
+            exporter = NodeCSVExporter()
+            try:
+                await exporter.connect()
+                await self.refresh(exporter)
+                self.last_error = None
+                await self.follow_model_changes(exporter)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.last_error = str(e)
+                logging.error(f"Address space refresh failed, retrying in {RETRY_DELAY} s: {e}")
+            finally:
+                if exporter.client:
+                    try:
+                        await exporter.client.disconnect()
+                    except Exception:
+                        pass
+            await asyncio.sleep(RETRY_DELAY)
+
+    async def refresh(self, exporter, full=False):
+        server_uri = (await exporter.client.get_node(ua.ObjectIds.Server_ServerArray).read_value())[0]
+        namespaces = await exporter.client.get_node(ua.ObjectIds.Server_NamespaceArray).read_value()
+        key = snapshot_key(server_uri, namespaces)
+        current = self.snapshot if self.snapshot and self.snapshot["key"] == key else None
+        if current and current["node_versions"] and not full:
+            changed = await self.changed_node_versions(exporter, current["node_versions"])
+            logging.info(f"Address space snapshot v{current['version']} matches server, {len(changed)} subtrees changed")
+            if changed:
+                await self.apply_changes(exporter, changed)
+        else:
+            await exporter.start_node_browse(exporter.client.get_root_node())
+            rows = await exporter.build_rows(list(exporter.nodes.values()))
+            await self.store(exporter, key, server_uri, namespaces, rows, current)
+        self.last_refresh = datetime.now(timezone.utc).isoformat()
+
+    async def read_node_versions(self, exporter, rows):
+        properties = node_version_properties(rows)
+        values = await exporter.read_attributes([ua.NodeId.from_string(p) for p in properties.values()], ua.AttributeIds.Value)
+        return {parent: {"property": prop, "value": value.Value.Value if value.StatusCode.is_good() else None}
+                for (parent, prop), value in zip(properties.items(), values)}
+
+    async def changed_node_versions(self, exporter, node_versions):
+        properties = [ua.NodeId.from_string(v["property"]) for v in node_versions.values()]
+        values = await exporter.read_attributes(properties, ua.AttributeIds.Value)
+        return [parent for (parent, known), value in zip(node_versions.items(), values)
+                if not value.StatusCode.is_good() or value.Value.Value != known["value"]]
+
+    async def store(self, exporter, key, server_uri, namespaces, rows, previous):
+        node_versions = await self.read_node_versions(exporter, rows)
+        if previous and previous["rows"] == rows and previous["node_versions"] == node_versions:
+            return
+        snapshot = {
+            "format": SNAPSHOT_FORMAT,
+            "key": key,
+            "server_uri": server_uri,
+            "namespaces": list(namespaces),
+            "version": (previous["version"] + 1) if previous else 1,
+            "created": datetime.now(timezone.utc).isoformat(),
+            "rows": rows,
+            "node_versions": node_versions,
+        }
+        # Writing tens of thousands of rows would stall the event loop, so files go in a thread
+        await asyncio.to_thread(save_snapshot, snapshot)
+        self.snapshot = snapshot
+        logging.info(f"Saved address space snapshot v{snapshot['version']} with {len(rows)} nodes")
+        await asyncio.to_thread(self.on_update, snapshot)
+
+    async def apply_changes(self, exporter, node_ids):
+        rows_by_id = {row[0]: row for row in self.snapshot["rows"]}
+        remove_subtrees(rows_by_id, node_ids)
+        records = await exporter.browse_subtrees([ua.NodeId.from_string(n) for n in node_ids])
+        for row in await exporter.build_rows(records):
+            rows_by_id[row[0]] = row
+        await self.store(exporter, self.snapshot["key"], self.snapshot["server_uri"], self.snapshot["namespaces"],
+                         list(rows_by_id.values()), self.snapshot)
+
+    async def event_notification(self, event):
+        changes = getattr(event, "Changes", None)
+        if not changes:
+            self._full_refresh = True
+        for change in changes or []:
+            self._changed.add((change.Affected.to_string(), change.Verb))
+        self._change_event.set()
+
+    async def follow_model_changes(self, exporter):
+        client = exporter.client
+        try:
+            subscription = await client.create_subscription(1000, self)
+            await subscription.subscribe_events(client.nodes.server, ua.ObjectIds.GeneralModelChangeEventType)
+        except Exception as e:
+            logging.info(f"Server doesn't support model change events, snapshot refreshes on reconnect only: {e}")
+        server_state = client.get_node(ua.ObjectIds.Server_ServerStatus_State)
+        while True:
+            try:
+                await asyncio.wait_for(self._change_event.wait(), WATCHDOG_INTERVAL)
+            except asyncio.TimeoutError:
+                await server_state.read_value()
+                continue
+            await asyncio.sleep(MODEL_CHANGE_DEBOUNCE)
+            self._change_event.clear()
+            changed, self._changed = self._changed, set()
+            full_refresh, self._full_refresh = self._full_refresh, False
+            if full_refresh or not self.snapshot:
+                exporter.nodes = {}
+                await self.refresh(exporter, full=True)
+                continue
+            targets = set()
+            known = {row[0]: row[2] for row in self.snapshot["rows"]}
+            for affected, verb in changed:
+                # Added and deleted nodes are picked up by re-browsing their parent
+                if verb & NODE_DELETED and affected in known:
+                    targets.add(known[affected] or affected)
+                elif verb & NODE_ADDED or affected not in known:
+                    parent = await client.get_node(affected).get_parent()
+                    targets.add(parent.nodeid.to_string() if parent else affected)
+                else:
+                    targets.add(affected)
+            await self.apply_changes(exporter, sorted(targets))
@@ -1,55 +1,721 @@
-from opcua import Client
+from asyncua import Client, ua
 from paho.mqtt import client as mqtt_client
+from paho.mqtt.client import MQTT_ERR_SUCCESS, error_string
+from collections import OrderedDict, deque
+from datetime import datetime, timezone
+import asyncio
+import heapq
+import itertools
 import time
-import json
 import csv
+import json
 import os
+import zlib
+from NodeCsvExporter import parse_node_ids
+from payload_codec import FORMATS, encode_samples, to_epoch_ns
+from pipeline_metrics import METRICS_INTERVAL, PipelineMetrics
 
-OPC_SERVER_URL = "opc.tcp://100.94.111.58:4841"
-MQTT_BROKER = "host.docker.internal"
-MQTT_PORT = 1883
+OPC_SERVER_URL = os.environ.get('OPC_SERVER_URL', "opc.tcp://100.94.111.58:4841")
+MQTT_BROKER = os.environ.get('MQTT_BROKER', "host.docker.internal")
+MQTT_PORT = int(os.environ.get('MQTT_PORT', 1883))
 MQTT_TOPIC = "plant1"
 SELECTED_CSV = "app/selected.csv"
+SETTINGS_FILE = "app/converter_settings.json"
 DEFAULT_READ_INTERVAL = 5
+# This worker acquires the nodes of selected.csv that hash to SHARD_INDEX (see node_shard)
+SHARD_INDEX = int(os.environ.get('SHARD_INDEX', 0))
+SHARD_COUNT = int(os.environ.get('SHARD_COUNT', 1))
+# How often selected.csv and the settings file are checked for changes (s)
+CONTROL_POLL_INTERVAL = float(os.environ.get('CONTROL_POLL_INTERVAL', 1))
+
+# "subscription" lets the server push changed values, "poll" keeps the read loop as a fallback
+ACQUISITION_MODE = os.environ.get('ACQUISITION_MODE', 'subscription')
+PUBLISHING_INTERVAL = int(os.environ.get('PUBLISHING_INTERVAL', 500))  # ms
+SAMPLING_INTERVAL = int(os.environ.get('SAMPLING_INTERVAL', 250))  # ms
+QUEUE_SIZE = int(os.environ.get('QUEUE_SIZE', 10))
+DEADBAND = float(os.environ.get('DEADBAND', 0))
+DEADBAND_PCT = float(os.environ.get('DEADBAND_PCT', 0))
+MONITORED_ITEMS_PER_CALL = int(os.environ.get('MONITORED_ITEMS_PER_CALL', 1000))
+# Used when the server reports MaxNodesPerRead as 0 (no limit) or doesn't expose it
+DEFAULT_MAX_NODES_PER_READ = int(os.environ.get('DEFAULT_MAX_NODES_PER_READ', 1000))
+
+# Bounded queue between OPC UA acquisition and MQTT publishing
+PUBLISH_QUEUE_SIZE = int(os.environ.get('PUBLISH_QUEUE_SIZE', 100000))
+PUBLISH_QUEUE_POLICY = os.environ.get('PUBLISH_QUEUE_POLICY', 'drop_oldest')  # drop_oldest | coalesce | block
+PUBLISH_BATCH_SIZE = int(os.environ.get('PUBLISH_BATCH_SIZE', 1000))
+RECONNECT_DELAY = int(os.environ.get('RECONNECT_DELAY', 5))
+MQTT_CONNECT_POLL = float(os.environ.get('MQTT_CONNECT_POLL', 0.5))  # s between checks while the broker is down
+WATCHDOG_INTERVAL = int(os.environ.get('WATCHDOG_INTERVAL', 5))
+STATS_INTERVAL = int(os.environ.get('STATS_INTERVAL', 10))
+
+# MQTT payload: json or binary (see payload_codec), one topic or plant1/<node>, samples per message
+PAYLOAD_FORMAT = os.environ.get('PAYLOAD_FORMAT', 'json')
+TOPIC_MODE = os.environ.get('TOPIC_MODE', 'single')  # single | per_node
+FRAME_SIZE = int(os.environ.get('FRAME_SIZE', 1))
+
+# Backfill: after every (re)connect, values missing in InfluxDB since the last
+# written timestamp of each node (WATERMARK_FILE, kept by mqtt_to_Influx_Converter)
+# are read with HistoryRead and published to BACKFILL_TOPIC at BACKFILL_RATE
+BACKFILL = os.environ.get('BACKFILL', 'false').lower() == 'true'
+BACKFILL_TOPIC = os.environ.get('BACKFILL_TOPIC', 'plant1/_backfill')
+WATERMARK_FILE = os.environ.get('WATERMARK_FILE', 'app/state/last_written.json')
+BACKFILL_MAX_AGE = float(os.environ.get('BACKFILL_MAX_AGE', 24 * 3600))  # s, older history is given up
+BACKFILL_MIN_GAP = float(os.environ.get('BACKFILL_MIN_GAP', 10))  # s, shorter gaps are samples still in flight
+BACKFILL_CHUNK = float(os.environ.get('BACKFILL_CHUNK', 3600))  # s of history per HistoryRead time range
+BACKFILL_NODES_PER_READ = int(os.environ.get('BACKFILL_NODES_PER_READ', 100))
+BACKFILL_VALUES_PER_NODE = int(os.environ.get('BACKFILL_VALUES_PER_NODE', 1000))  # per response, then continuation points
+BACKFILL_CONCURRENCY = int(os.environ.get('BACKFILL_CONCURRENCY', 4))  # HistoryRead requests in flight
+BACKFILL_RATE = float(os.environ.get('BACKFILL_RATE', 5000))  # samples/s
+BACKFILL_FRAME_SIZE = int(os.environ.get('BACKFILL_FRAME_SIZE', 100))  # samples per MQTT message
+
+QUEUE_POLICIES = ("drop_oldest", "coalesce", "block")
+
+# Keys the subscription's notifications back to their monitored items, unique per process
+client_handles = itertools.count(1)
+
+metrics = PipelineMetrics(f"opcua_to_mqtt-{SHARD_INDEX}" if SHARD_COUNT > 1 else "opcua_to_mqtt")
+
+class PublishQueue:
+    # Samples are (node_id, value, source_timestamp, status_code) tuples.
+    # drop_oldest discards the oldest sample when full, coalesce keeps only the
+    # latest pending sample per node, block makes producers wait for space.
+    def __init__(self, maxsize, policy):
+        if policy not in QUEUE_POLICIES:
+            raise ValueError(f"Unknown publish queue policy: {policy}")
+        self.maxsize = maxsize
+        self.policy = policy
+        self._items = OrderedDict() if policy == "coalesce" else deque()
+        self._not_empty = asyncio.Event()
+        self._not_full = asyncio.Event()
+        self._not_full.set()
+        self.dropped = 0
+        self.coalesced = 0
+
+    def __len__(self):
+        return len(self._items)
 
-def read_selected_nodes():
+    async def put(self, sample):
+        if self.policy == "coalesce" and sample[0] in self._items:
+            self._items[sample[0]] = sample
+            self.coalesced += 1
+            return
+        while len(self._items) >= self.maxsize:
+            if self.policy == "block":
+                self._not_full.clear()
+                await self._not_full.wait()
+            else:
+                self._pop()
+                self.dropped += 1
+        if self.policy == "coalesce":
+            self._items[sample[0]] = sample
+        else:
+            self._items.append(sample)
+        self._not_empty.set()
+
+    async def get_batch(self, max_items):
+        while not self._items:
+            self._not_empty.clear()
+            await self._not_empty.wait()
+        batch = [self._pop() for _ in range(min(max_items, len(self._items)))]
+        self._not_full.set()
+        return batch
+
+    def _pop(self):
+        if self.policy == "coalesce":
+            return self._items.popitem(last=False)[1]
+        return self._items.popleft()
+
+def node_shard(node_id, shard_count):
+    # Stable across processes and runs, unlike hash()
+    return zlib.crc32(node_id.encode()) % shard_count
+
+def node_settings_from_row(row):
+    # interval (s, poll mode; also the sampling interval when sampling_interval (ms) isn't set),
+    # queue_size, deadband (absolute) and deadband_pct are optional per-node columns
+    interval = float(row['interval']) if row.get('interval') else None
+    return {
+        "node_id": row['node_id'],
+        "interval": interval,
+        "sampling_interval": float(row.get('sampling_interval') or (interval * 1000 if interval else SAMPLING_INTERVAL)),
+        "queue_size": int(row.get('queue_size') or QUEUE_SIZE),
+        "deadband": float(row.get('deadband') or DEADBAND),
+        "deadband_pct": float(row.get('deadband_pct') or DEADBAND_PCT),
+    }
+
+def read_selected_node_settings():
+    # Only this worker's shard is returned, so every worker rebalances itself on selection changes
     with open(SELECTED_CSV, mode='r') as file:
-        return [row['node_id'] for row in csv.DictReader(file)]
+        return [node_settings_from_row(row) for row in csv.DictReader(file)
+                if node_shard(row['node_id'], SHARD_COUNT) == SHARD_INDEX]
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+class DeadbandFilter:
+    # Client-side deadband, for poll mode and for percent deadbands in both modes.
+    # A sample of a node with a deadband is only published when its status
+    # changed or its value moved by more than the absolute deadband and by more
+    # than deadband_pct percent of the last published value. Non-numeric values
+    # are published whenever they change.
+    def __init__(self):
+        self.limits = {}  # node id -> (deadband, deadband_pct)
+        self.last = {}  # node id -> (value, status) last published
+        self.suppressed = 0
+
+    def configure(self, node_settings):
+        self.limits = {s["node_id"]: (s["deadband"], s["deadband_pct"]) for s in node_settings
+                       if s["deadband"] > 0 or s["deadband_pct"] > 0}
+        self.last = {node_id: last for node_id, last in self.last.items() if node_id in self.limits}
+
+    def accept(self, sample):
+        node_id, value, _, status = sample
+        limits = self.limits.get(node_id)
+        if limits is None:
+            return True
+        last = self.last.get(node_id)
+        if last is not None and last[1] == status and not self.moved(last[0], value, *limits):
+            self.suppressed += 1
+            return False
+        self.last[node_id] = (value, status)
+        return True
+
+    @staticmethod
+    def moved(last, value, deadband, deadband_pct):
+        if not (is_number(last) and is_number(value)):
+            return value != last
+        change = abs(value - last)
+        return change > deadband and change > abs(last) * deadband_pct / 100
+
+def read_settings():
+    # Written by the web app, overrides READ_INTERVAL from the environment
+    try:
+        with open(SETTINGS_FILE, mode='r') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+class BridgeControl:
+    # Control channel between the web app and the running bridge. The app
+    # replaces selected.csv and the settings file; changes are picked up by
+    # polling their mtimes and announced through the changed event, so the
+    # acquisition loops can adjust monitored items or the poll set in place.
+    def __init__(self):
+        self.node_settings = []
+        self.read_interval = DEFAULT_READ_INTERVAL
+        self.deadband = DeadbandFilter()
+        self.changed = asyncio.Event()
+        self._mtimes = None
+        self.reload()
+
+    def _stat(self):
+        mtimes = []
+        for path in (SELECTED_CSV, SETTINGS_FILE):
+            try:
+                mtimes.append(os.stat(path).st_mtime_ns)
+            except OSError:
+                mtimes.append(None)
+        return mtimes
+
+    def reload(self):
+        mtimes = self._stat()
+        if mtimes == self._mtimes:
+            return False
+        try:
+            node_settings = read_selected_node_settings()
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Error reading {SELECTED_CSV}, keeping the current selection: {e}")
+            return False
+        self._mtimes = mtimes
+        self.node_settings = node_settings
+        self.deadband.configure(node_settings)
+        self.read_interval = int(read_settings().get('read_interval') or os.environ.get('READ_INTERVAL', DEFAULT_READ_INTERVAL))
+        return True
+
+    async def watch(self):
+        while True:
+            await asyncio.sleep(CONTROL_POLL_INTERVAL)
+            if self.reload():
+                print(f"Control: {len(self.node_settings)} nodes selected, read interval {self.read_interval} s")
+                self.changed.set()
+
+    async def wait_for_change(self, timeout):
+        if not self.changed.is_set():
+            try:
+                await asyncio.wait_for(self.changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                return False
+        self.changed.clear()
+        return True
+
+def short_node_id(node_id):
+    return node_id.replace("ns=2;s=DB15.", "")
+
+def on_mqtt_connect(client, userdata, flags, rc):
+    print("Connected to MQTT Broker" if rc == 0 else f"MQTT connection failed, rc: {rc}")
+    metrics.inc("mqtt_connects" if rc == 0 else "mqtt_connect_failures")
+
+def on_mqtt_disconnect(client, userdata, rc):
+    print(f"Disconnected from MQTT Broker, rc: {rc}")
+    metrics.inc("mqtt_disconnects")
 
 def connect_mqtt():
+    # connect_async + loop_start keeps connecting and reconnecting on paho's own thread
     client = mqtt_client.Client()
-    client.connect(MQTT_BROKER, MQTT_PORT)
-    print("Connected to MQTT Broker")
+    client.on_connect = on_mqtt_connect
+    client.on_disconnect = on_mqtt_disconnect
+    client.connect_async(MQTT_BROKER, MQTT_PORT)
+    client.loop_start()
     return client
 
-def read_opcua_data(opcua_client, mqtt_client):
-    opcua_client.connect()
-    print("Connected to OPC UA server")
+async def wait_for_mqtt(mqtt_client):
+    # paho discards QoS 0 messages published while disconnected, so nothing is
+    # taken from the publish queue until the broker is back and the queue policy applies
+    if mqtt_client.is_connected():
+        return
+    while not mqtt_client.is_connected():
+        await asyncio.sleep(MQTT_CONNECT_POLL)
+    print("MQTT connected, publishing")
+
+def node_topic(node_id_short):
+    # + and # are MQTT wildcards and can't appear in a topic name
+    return f"{MQTT_TOPIC}/{node_id_short.replace('+', '_').replace('#', '_')}"
+
+def build_messages(batch):
+    samples = [(short_node_id(node_id), value, to_epoch_ns(timestamp), status) for node_id, value, timestamp, status in batch]
+    if TOPIC_MODE == "per_node":
+        groups = {}
+        for sample in samples:
+            groups.setdefault(node_topic(sample[0]), []).append(sample)
+    else:
+        groups = {MQTT_TOPIC: samples}
+    messages = []
+    for topic, group in groups.items():
+        for start in range(0, len(group), FRAME_SIZE):
+            messages.append((topic, group[start:start + FRAME_SIZE]))
+    return messages
+
+def publish_message(mqtt_client, topic, frame):
+    try:
+        info = mqtt_client.publish(topic, encode_samples(frame, PAYLOAD_FORMAT))
+        if info.rc != MQTT_ERR_SUCCESS:
+            raise ConnectionError(error_string(info.rc))
+    except Exception as e:
+        print(f"Error publishing {len(frame)} samples to {topic}: {e}")
+        metrics.inc("publish_errors")
+        return False
+    return True
+
+def publish_batch(mqtt_client, batch):
+    published = 0
+    for topic, frame in build_messages(batch):
+        if not publish_message(mqtt_client, topic, frame):
+            continue
+        now_ns = time.time_ns()
+        for node_id_short, value, timestamp_ns, _ in frame:
+            print(f"Published: {node_id_short} = {value}")
+            metrics.seen(node_id_short, timestamp_ns / 1e9)
+        metrics.observe("source_to_publish_seconds", [(now_ns - sample[2]) / 1e9 for sample in frame])
+        metrics.inc("messages_published")
+        metrics.inc("samples_published", len(frame))
+        published += len(frame)
+    return published
 
+async def metrics_worker(queue, control):
     while True:
-        for node_id in read_selected_nodes():
+        await asyncio.sleep(METRICS_INTERVAL)
+        metrics.set_gauge("publish_queue_depth", len(queue))
+        metrics.set_gauge("nodes_selected", len(control.node_settings))
+        metrics.set_total("publish_queue_dropped", queue.dropped)
+        metrics.set_total("publish_queue_coalesced", queue.coalesced)
+        metrics.set_total("deadband_suppressed", control.deadband.suppressed)
+        try:
+            metrics.dump()
+        except OSError as e:
+            print(f"Error writing metrics: {e}")
+
+async def publish_worker(queue, mqtt_client, deadband):
+    published = 0
+    last_stats = time.monotonic()
+    while True:
+        await wait_for_mqtt(mqtt_client)
+        batch = await queue.get_batch(PUBLISH_BATCH_SIZE)
+        published += publish_batch(mqtt_client, batch)
+        # Wait for paho to hand the batch to the socket, so a slow broker fills
+        # the publish queue (and triggers its policy) instead of paho's buffer
+        while mqtt_client.want_write():
+            await asyncio.sleep(0.005)
+        if time.monotonic() - last_stats >= STATS_INTERVAL:
+            print(f"Publish queue: {len(queue)} pending, {published} published, {queue.dropped} dropped, "
+                  f"{queue.coalesced} coalesced, {deadband.suppressed} within deadband")
+            last_stats = time.monotonic()
+
+def sample_from_data_value(node_id, data_value):
+    source_timestamp = data_value.SourceTimestamp or datetime.now(timezone.utc)
+    return (node_id, data_value.Value.Value, source_timestamp, data_value.StatusCode.value)
+
+class DataChangeHandler:
+    def __init__(self, queue, deadband):
+        self.queue = queue
+        self.deadband = deadband
+
+    async def datachange_notification(self, node, val, data):
+        sample = sample_from_data_value(node.nodeid.to_string(), data.monitored_item.Value)
+        metrics.inc("samples_read")
+        if self.deadband.accept(sample):
+            await self.queue.put(sample)
+
+    async def status_change_notification(self, status):
+        print(f"Subscription status changed: {status}")
+
+def make_monitored_item_request(nodeid, settings):
+    request = ua.MonitoredItemCreateRequest()
+    request.ItemToMonitor.NodeId = nodeid
+    request.ItemToMonitor.AttributeId = ua.AttributeIds.Value
+    request.MonitoringMode = ua.MonitoringMode.Reporting
+    request.RequestedParameters.ClientHandle = next(client_handles)
+    request.RequestedParameters.SamplingInterval = settings["sampling_interval"]
+    request.RequestedParameters.QueueSize = settings["queue_size"]
+    request.RequestedParameters.DiscardOldest = True
+    if settings["deadband"] > 0:
+        deadband_filter = ua.DataChangeFilter()
+        deadband_filter.Trigger = ua.DataChangeTrigger.StatusValue
+        deadband_filter.DeadbandType = ua.DeadbandType.Absolute
+        deadband_filter.DeadbandValue = settings["deadband"]
+        request.RequestedParameters.Filter = deadband_filter
+    return request
+
+async def create_monitored_items(subscription, node_settings):
+    # node id -> monitored item handle for the items the server accepted; malformed ids are skipped
+    parsed, invalid = parse_node_ids([settings["node_id"] for settings in node_settings])
+    for node_id, error in invalid.items():
+        print(f"Skipping {node_id}: {error}")
+    items = [(settings, parsed[settings["node_id"]]) for settings in node_settings if settings["node_id"] in parsed]
+    handles = {}
+    for start in range(0, len(items), MONITORED_ITEMS_PER_CALL):
+        chunk = items[start:start + MONITORED_ITEMS_PER_CALL]
+        requests = [make_monitored_item_request(nodeid, settings) for settings, nodeid in chunk]
+        for (settings, _), result in zip(chunk, await subscription.create_monitored_items(requests)):
+            if isinstance(result, ua.StatusCode):
+                print(f"Error monitoring {settings['node_id']}: {result.name}")
+            else:
+                handles[settings["node_id"]] = result
+    return handles
+
+def monitored_item_settings(settings):
+    # The settings the server applies; the others are handled by the bridge
+    return {key: settings[key] for key in ("node_id", "sampling_interval", "queue_size", "deadband")}
+
+async def sync_monitored_items(subscription, monitored, node_settings):
+    # monitored: node id -> (settings, handle). Items with changed settings are
+    # recreated before the old ones are deleted, so no value change is missed.
+    wanted = {settings["node_id"]: monitored_item_settings(settings) for settings in node_settings}
+    to_create = [settings for node_id, settings in wanted.items()
+                 if node_id not in monitored or monitored[node_id][0] != settings]
+    created = await create_monitored_items(subscription, to_create)
+    # Removed nodes go away, changed ones only once their replacement exists
+    stale = [node_id for node_id, (settings, _) in monitored.items()
+             if node_id not in wanted or (settings != wanted[node_id] and node_id in created)]
+    to_delete = [monitored.pop(node_id)[1] for node_id in stale]
+    if to_delete:
+        await subscription.unsubscribe(to_delete)
+    for node_id, handle in created.items():
+        monitored[node_id] = (wanted[node_id], handle)
+    return len(created), len(to_delete)
+
+async def subscribe_opcua_data(opcua_client, queue, control):
+    subscription = await opcua_client.create_subscription(PUBLISHING_INTERVAL, DataChangeHandler(queue, control.deadband))
+    control.changed.clear()
+    monitored = {}
+    await sync_monitored_items(subscription, monitored, control.node_settings)
+    print(f"Subscribed to {len(monitored)} of {len(control.node_settings)} nodes (publishing interval {PUBLISHING_INTERVAL} ms)")
+
+    # A cheap read of the server state between selection changes; raises once the session is gone
+    server_state = opcua_client.get_node(ua.ObjectIds.Server_ServerStatus_State)
+    while True:
+        if not await control.wait_for_change(WATCHDOG_INTERVAL):
+            await server_state.read_value()
+            continue
+        created, deleted = await sync_monitored_items(subscription, monitored, control.node_settings)
+        print(f"Selection applied: {created} monitored items created, {deleted} deleted, {len(monitored)} monitored")
+
+async def read_max_nodes_per_read(opcua_client):
+    try:
+        limit = await opcua_client.get_node(ua.ObjectIds.Server_ServerCapabilities_OperationLimits_MaxNodesPerRead).read_value()
+    except Exception as e:
+        print(f"Could not read MaxNodesPerRead, using {DEFAULT_MAX_NODES_PER_READ}: {e}")
+        return DEFAULT_MAX_NODES_PER_READ
+    return limit or DEFAULT_MAX_NODES_PER_READ
+
+async def read_values_batched(opcua_client, node_ids, max_nodes_per_read):
+    # One Read service call per chunk; results come back in request order
+    results = {}
+    for start in range(0, len(node_ids), max_nodes_per_read):
+        chunk = node_ids[start:start + max_nodes_per_read]
+        params = ua.ReadParameters()
+        for _, nodeid in chunk:
+            rv = ua.ReadValueId()
+            rv.NodeId = nodeid
+            rv.AttributeId = ua.AttributeIds.Value
+            params.NodesToRead.append(rv)
+        for (node_id, _), data_value in zip(chunk, await opcua_client.uaclient.read(params)):
+            results[node_id] = data_value
+    return results
+
+def poll_groups(node_settings, default_interval):
+    # interval (s) -> [(node id string, NodeId)], nodes without their own interval use READ_INTERVAL
+    parsed, invalid = parse_node_ids([settings["node_id"] for settings in node_settings])
+    for node_id, error in invalid.items():
+        print(f"Skipping {node_id}: {error}")
+    groups = {}
+    for settings in node_settings:
+        if settings["node_id"] in parsed:
+            groups.setdefault(settings["interval"] or default_interval, []).append((settings["node_id"], parsed[settings["node_id"]]))
+    return groups
+
+async def read_opcua_data(opcua_client, queue, control):
+    max_nodes_per_read = await read_max_nodes_per_read(opcua_client)
+    print(f"Polling with up to {max_nodes_per_read} nodes per Read request")
+    control.changed.clear()
+    groups = poll_groups(control.node_settings, control.read_interval)
+    # Priority queue of (next due time, interval); every interval group is read with batched Reads when due
+    schedule = [(time.monotonic(), interval) for interval in groups]
+    heapq.heapify(schedule)
+
+    while True:
+        timeout = max(0.0, schedule[0][0] - time.monotonic()) if schedule else None
+        if await control.wait_for_change(timeout):
+            # Intervals that still exist keep their schedule, new ones are due right away
+            groups = poll_groups(control.node_settings, control.read_interval)
+            due_times = {interval: due for due, interval in schedule}
+            schedule = [(due_times.get(interval, time.monotonic()), interval) for interval in groups]
+            heapq.heapify(schedule)
+            continue
+
+        due, interval = schedule[0]
+        node_ids = groups[interval]
+        cycle_start = time.monotonic()
+        results = await read_values_batched(opcua_client, node_ids, max_nodes_per_read)
+        read_done = time.monotonic()
+        metrics.inc("samples_read", len(results))
+        metrics.inc("poll_cycles")
+
+        queued = 0
+        for node_id, data_value in results.items():
+            if not data_value.StatusCode.is_good():
+                print(f"Error reading {node_id}: {data_value.StatusCode.name}")
+                metrics.inc("read_errors")
+                continue
+            sample = sample_from_data_value(node_id, data_value)
+            if control.deadband.accept(sample):
+                await queue.put(sample)
+                queued += 1
+        queue_done = time.monotonic()
+
+        # Missed slots are skipped rather than read back to back
+        overrun = max(0.0, queue_done - (due + interval))
+        if overrun:
+            metrics.inc("poll_overruns")
+        heapq.heapreplace(schedule, (max(due + interval, queue_done), interval))
+        print(f"Cycle: {queued}/{len(node_ids)} nodes queued, read {(read_done - cycle_start) * 1000:.1f} ms, "
+              f"enqueue {(queue_done - read_done) * 1000:.1f} ms, overrun {overrun * 1000:.1f} ms "
+              f"(interval {interval} s, {len(queue)} pending publish)")
+
+def read_last_written():
+    try:
+        with open(WATERMARK_FILE, mode='r') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+def backfill_ranges(node_settings, until_ns):
+    # (start ns, node id, NodeId) of the nodes whose newest written sample is more than
+    # BACKFILL_MIN_GAP old; nodes that were never written have nothing to continue from
+    last_written = read_last_written()
+    oldest_ns = until_ns - int(BACKFILL_MAX_AGE * 1e9)
+    ranges = []
+    parsed, _ = parse_node_ids([settings["node_id"] for settings in node_settings])
+    for node_id, nodeid in parsed.items():
+        written_ns = last_written.get(short_node_id(node_id))
+        if written_ns and until_ns - written_ns >= BACKFILL_MIN_GAP * 1e9:
+            ranges.append((max(written_ns, oldest_ns), node_id, nodeid))
+    return sorted(ranges, key=lambda r: r[0])
+
+def ns_to_datetime(timestamp_ns):
+    return datetime.fromtimestamp(timestamp_ns / 1e9, timezone.utc)
+
+class RateLimiter:
+    # Spaces out work to `rate` units per second, shared by every caller
+    def __init__(self, rate):
+        self.interval = 1 / rate
+        self.next = time.monotonic()
+
+    async def acquire(self, amount):
+        now = time.monotonic()
+        start = max(self.next, now)
+        self.next = start + amount * self.interval
+        await asyncio.sleep(start - now)
+
+async def history_read_raw(opcua_client, nodes, start_ns, end_ns):
+    # Yields (node id, status, data values) per node and response. Follows continuation
+    # points, and when a server cuts a response at NumValuesPerNode without one (asyncua
+    # does), reads on from the newest value returned; that value comes again.
+    requests = [(start_ns, [(node_id, nodeid, None) for node_id, nodeid in nodes])]
+    while requests:
+        request_start_ns, pending = requests.pop()
+        details = ua.ReadRawModifiedDetails(IsReadModified=False, StartTime=ns_to_datetime(request_start_ns),
+                                            EndTime=ns_to_datetime(end_ns), NumValuesPerNode=BACKFILL_VALUES_PER_NODE,
+                                            ReturnBounds=False)
+        params = ua.HistoryReadParameters(HistoryReadDetails=details, TimestampsToReturn=ua.TimestampsToReturn.Source,
+                                          ReleaseContinuationPoints=False,
+                                          NodesToRead=[ua.HistoryReadValueId(NodeId=nodeid, ContinuationPoint=point)
+                                                       for _, nodeid, point in pending])
+        results = await opcua_client.uaclient.history_read(params)
+        continued, truncated = [], []
+        for (node_id, nodeid, _), result in zip(pending, results):
+            data_values = (result.HistoryData.DataValues if result.HistoryData else None) or []
+            yield node_id, result.StatusCode, data_values
+            if not result.StatusCode.is_good():
+                continue
+            if result.ContinuationPoint:
+                continued.append((node_id, nodeid, result.ContinuationPoint))
+            elif len(data_values) >= BACKFILL_VALUES_PER_NODE and data_values[-1].SourceTimestamp:
+                last_ns = to_epoch_ns(data_values[-1].SourceTimestamp)
+                if last_ns > request_start_ns:
+                    truncated.append((last_ns, (node_id, nodeid, None)))
+        if continued:
+            requests.append((request_start_ns, continued))
+        if truncated:
+            requests.append((min(last_ns for last_ns, _ in truncated), [node for _, node in truncated]))
+
+def publish_backfill(mqtt_client, samples):
+    # Own topic, so consumers keep backfilled samples out of live latency and freshness figures
+    samples = [(short_node_id(node_id), value, to_epoch_ns(timestamp), status) for node_id, value, timestamp, status in samples]
+    published = 0
+    for start in range(0, len(samples), BACKFILL_FRAME_SIZE):
+        frame = samples[start:start + BACKFILL_FRAME_SIZE]
+        if publish_message(mqtt_client, BACKFILL_TOPIC, frame):
+            metrics.inc("backfill_samples_published", len(frame))
+            published += len(frame)
+    return published
+
+async def publish_backfill_paced(mqtt_client, queue, limiter, samples):
+    published = 0
+    for start in range(0, len(samples), PUBLISH_BATCH_SIZE):
+        batch = samples[start:start + PUBLISH_BATCH_SIZE]
+        # Live samples go first: no backfill while the publish queue has a backlog
+        while len(queue) >= PUBLISH_BATCH_SIZE:
+            await asyncio.sleep(0.1)
+        await limiter.acquire(len(batch))
+        await wait_for_mqtt(mqtt_client)
+        published += publish_backfill(mqtt_client, batch)
+        while mqtt_client.want_write():
+            await asyncio.sleep(0.005)
+    return published
+
+async def backfill_group(opcua_client, mqtt_client, queue, limiter, semaphore, group, until_ns):
+    # The nodes of a group share HistoryRead requests from the group's oldest start
+    # in BACKFILL_CHUNK slices; a node's values up to its own start were written already
+    starts = {node_id: start_ns for start_ns, node_id, _ in group}
+    nodes = [(node_id, nodeid) for _, node_id, nodeid in group]
+    failed = {}
+    published = 0
+    chunk_ns = int(BACKFILL_CHUNK * 1e9)
+    for chunk_start in range(group[0][0], until_ns, chunk_ns):
+        if not nodes:
+            break
+        async with semaphore:
+            samples = []
+            async for node_id, status, data_values in history_read_raw(opcua_client, nodes, chunk_start,
+                                                                        min(chunk_start + chunk_ns, until_ns)):
+                if not status.is_good():
+                    failed[node_id] = status.name
+                    metrics.inc("backfill_read_errors")
+                    continue
+                for data_value in data_values:
+                    if not data_value.SourceTimestamp or not data_value.StatusCode.is_good():
+                        continue
+                    sample = sample_from_data_value(node_id, data_value)
+                    timestamp_ns = to_epoch_ns(sample[2])
+                    if starts[node_id] < timestamp_ns <= until_ns:
+                        starts[node_id] = timestamp_ns
+                        samples.append(sample)
+                if len(samples) >= PUBLISH_BATCH_SIZE:
+                    published += await publish_backfill_paced(mqtt_client, queue, limiter, samples)
+                    samples = []
+            published += await publish_backfill_paced(mqtt_client, queue, limiter, samples)
+        nodes = [(node_id, nodeid) for node_id, nodeid in nodes if node_id not in failed]
+    if failed:
+        print(f"HistoryRead failed for {len(failed)} nodes: {', '.join(sorted(set(failed.values())))}")
+    return published
+
+async def backfill(opcua_client, mqtt_client, queue, node_settings, until_ns):
+    ranges = backfill_ranges(node_settings, until_ns)
+    if not ranges:
+        return
+    print(f"Backfilling {len(ranges)} nodes, oldest gap {(until_ns - ranges[0][0]) / 1e9:.0f} s")
+    metrics.inc("backfill_runs")
+    started = time.monotonic()
+    limiter = RateLimiter(BACKFILL_RATE)
+    semaphore = asyncio.Semaphore(BACKFILL_CONCURRENCY)
+    try:
+        counts = await asyncio.gather(*(backfill_group(opcua_client, mqtt_client, queue, limiter, semaphore,
+                                                       ranges[start:start + BACKFILL_NODES_PER_READ], until_ns)
+                                        for start in range(0, len(ranges), BACKFILL_NODES_PER_READ)))
+        print(f"Backfill done: {sum(counts)} samples of {len(ranges)} nodes in {time.monotonic() - started:.1f} s")
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        print(f"Backfill error: {e}")
+
+async def acquire_opcua_data(queue, control, mqtt_client):
+    while True:
+        opcua_client = Client(OPC_SERVER_URL)
+        backfill_task = None
+        try:
+            await opcua_client.connect()
+            print("Connected to OPC UA server")
+            metrics.inc("opcua_connects")
+            if BACKFILL:
+                # Runs beside live acquisition; the gap ends where live acquisition starts
+                backfill_task = asyncio.create_task(backfill(opcua_client, mqtt_client, queue, control.node_settings, time.time_ns()))
+            if ACQUISITION_MODE == "poll":
+                await read_opcua_data(opcua_client, queue, control)
+            else:
+                await subscribe_opcua_data(opcua_client, queue, control)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"OPC UA connection error: {e}; reconnecting in {RECONNECT_DELAY} s")
+            metrics.inc("opcua_reconnects")
+        finally:
+            if backfill_task:
+                backfill_task.cancel()
             try:
-                value = opcua_client.get_node(node_id).get_value()
-                node_id_short = node_id.replace("ns=2;s=DB15.", "")
-                mqtt_payload = json.dumps({"node_id": node_id_short, "value": value})
-                mqtt_client.publish(MQTT_TOPIC, mqtt_payload)
-                print(f"Published: {node_id_short} = {value}")
-            except Exception as e:
-                print(f"Error reading {node_id}: {e}")
-        read_interval = int(os.environ.get('READ_INTERVAL', DEFAULT_READ_INTERVAL))
-        time.sleep(read_interval)
-
-def main():
+                await opcua_client.disconnect()
+            except Exception:
+                pass
+        await asyncio.sleep(RECONNECT_DELAY)
+
+async def main():
+    if PAYLOAD_FORMAT not in FORMATS:
+        raise ValueError(f"Unknown payload format: {PAYLOAD_FORMAT}")
+    if not 0 <= SHARD_INDEX < SHARD_COUNT:
+        raise ValueError(f"Invalid shard {SHARD_INDEX} of {SHARD_COUNT}")
+    if SHARD_COUNT > 1:
+        print(f"Worker for shard {SHARD_INDEX} of {SHARD_COUNT}")
     mqtt_client = connect_mqtt()
-    opcua_client = Client(OPC_SERVER_URL)
+    queue = PublishQueue(PUBLISH_QUEUE_SIZE, PUBLISH_QUEUE_POLICY)
+    control = BridgeControl()
     try:
-        read_opcua_data(opcua_client, mqtt_client)
-    except KeyboardInterrupt:
-        print("Stopping...")
+        await asyncio.gather(acquire_opcua_data(queue, control, mqtt_client), publish_worker(queue, mqtt_client, control.deadband), control.watch(),
+                             metrics_worker(queue, control))
     finally:
-        opcua_client.disconnect()
+        mqtt_client.loop_stop()
         mqtt_client.disconnect()
         print("Disconnected from servers")
 
 if __name__ == "__main__":
-    main()
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        print("Stopping...")
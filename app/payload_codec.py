@@ -0,0 +1,115 @@
+import json
+import struct
+from datetime import timezone
+
+# Shared MQTT payload format for both converters. A sample is a
+# (node_id, value, timestamp_ns, status_code) tuple and every payload carries one
+# or more samples. decode_samples() detects the format, so consumers understand
+# every format the bridge can be configured to send.
+#
+# binary: MAGIC, version, uint32 sample count, then per sample
+#   uint16 node id length, node id (utf-8), int64 timestamp (ns), uint32 status,
+#   uint8 value type, value (bool: uint8, int: int64, float: float64,
+#   str: uint32 length + utf-8, none: nothing)
+# json:   one sample as {"node_id", "value", "ts", "status"},
+#         a frame as {"samples": [...]} of those objects
+
+FORMATS = ("json", "binary")
+MAGIC = 0xDF
+VERSION = 1
+
+_HEADER = struct.Struct("!BBI")
+_NODE_ID_LENGTH = struct.Struct("!H")
+_SAMPLE_META = struct.Struct("!qIB")
+_STR_LENGTH = struct.Struct("!I")
+_TYPE_NONE, _TYPE_BOOL, _TYPE_INT, _TYPE_FLOAT, _TYPE_STR = range(5)
+_VALUE_STRUCTS = {_TYPE_BOOL: struct.Struct("!?"), _TYPE_INT: struct.Struct("!q"), _TYPE_FLOAT: struct.Struct("!d")}
+
+def to_epoch_ns(timestamp):
+    # OPC UA stacks hand out naive datetimes in UTC
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return int(timestamp.timestamp() * 1_000_000) * 1000
+
+def _value_type(value):
+    if value is None:
+        return _TYPE_NONE
+    if isinstance(value, bool):
+        return _TYPE_BOOL
+    if isinstance(value, int) and -2 ** 63 <= value < 2 ** 63:
+        return _TYPE_INT
+    if isinstance(value, float):
+        return _TYPE_FLOAT
+    return _TYPE_STR
+
+def _encode_binary(samples):
+    parts = [_HEADER.pack(MAGIC, VERSION, len(samples))]
+    for node_id, value, timestamp_ns, status in samples:
+        node_id_bytes = node_id.encode()
+        value_type = _value_type(value)
+        parts.append(_NODE_ID_LENGTH.pack(len(node_id_bytes)))
+        parts.append(node_id_bytes)
+        parts.append(_SAMPLE_META.pack(timestamp_ns or 0, status or 0, value_type))
+        if value_type == _TYPE_STR:
+            value_bytes = str(value).encode()
+            parts.append(_STR_LENGTH.pack(len(value_bytes)))
+            parts.append(value_bytes)
+        elif value_type != _TYPE_NONE:
+            parts.append(_VALUE_STRUCTS[value_type].pack(value))
+    return b"".join(parts)
+
+def _decode_binary(payload):
+    _, version, count = _HEADER.unpack_from(payload, 0)
+    if version != VERSION:
+        raise ValueError(f"Unsupported binary payload version: {version}")
+    offset = _HEADER.size
+    samples = []
+    for _ in range(count):
+        (node_id_length,) = _NODE_ID_LENGTH.unpack_from(payload, offset)
+        offset += _NODE_ID_LENGTH.size
+        node_id = payload[offset:offset + node_id_length].decode()
+        offset += node_id_length
+        timestamp_ns, status, value_type = _SAMPLE_META.unpack_from(payload, offset)
+        offset += _SAMPLE_META.size
+        if value_type == _TYPE_NONE:
+            value = None
+        elif value_type == _TYPE_STR:
+            (value_length,) = _STR_LENGTH.unpack_from(payload, offset)
+            offset += _STR_LENGTH.size
+            value = payload[offset:offset + value_length].decode()
+            offset += value_length
+        else:
+            value_struct = _VALUE_STRUCTS[value_type]
+            (value,) = value_struct.unpack_from(payload, offset)
+            offset += value_struct.size
+        samples.append((node_id, value, timestamp_ns or None, status))
+    return samples
+
+def _sample_to_json(sample):
+    node_id, value, timestamp_ns, status = sample
+    return {"node_id": node_id, "value": value, "ts": timestamp_ns, "status": status}
+
+def _sample_from_json(data):
+    return (data.get("node_id", "unknown_sensor"), data.get("value", 0), data.get("ts"), data.get("status", 0))
+
+def encode_samples(samples, payload_format="json"):
+    if payload_format == "binary":
+        return _encode_binary(samples)
+    if payload_format != "json":
+        raise ValueError(f"Unknown payload format: {payload_format}")
+    if len(samples) == 1:
+        return json.dumps(_sample_to_json(samples[0]), default=str).encode()
+    return json.dumps({"samples": [_sample_to_json(s) for s in samples]}, default=str).encode()
+
+def decode_samples(payload):
+    if payload[:1] == bytes([MAGIC]):
+        return _decode_binary(payload)
+    text = payload.decode()
+    try:
+        data = json.loads(text)
+    except ValueError:
+        # Older publishers sent Python reprs with single quotes
+        data = json.loads(text.replace("'", '"'))
+    if isinstance(data, dict) and "samples" in data:
+        return [_sample_from_json(s) for s in data["samples"]]
+    return [_sample_from_json(data)]
@@ -0,0 +1,199 @@
+import bisect
+import json
+import os
+import threading
+import time
+
+# Pipeline instrumentation shared by both converters and the web app. Each
+# converter process keeps a PipelineMetrics and dumps it as JSON into
+# METRICS_DIR every METRICS_INTERVAL seconds; the web app reads those files and
+# serves them as Prometheus text (/metrics) or a compact JSON view.
+METRICS_DIR = os.environ.get('METRICS_DIR', 'app/state')
+METRICS_INTERVAL = float(os.environ.get('METRICS_INTERVAL', 5))  # s
+# Dumps older than this (e.g. of a shard that is no longer started) are not served
+METRICS_MAX_AGE = float(os.environ.get('METRICS_MAX_AGE', 12 * METRICS_INTERVAL))  # s
+# Source timestamp to publish/write acknowledgment, in s
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self):
+        return {"buckets": list(self.buckets), "counts": list(self.counts), "sum": self.sum, "count": self.count}
+
+def histogram_quantile(snapshot, quantile):
+    # Upper bound of the bucket holding the quantile, like Prometheus without
+    # interpolation; ">last bound" when it falls into the +Inf bucket
+    if not snapshot["count"]:
+        return None
+    rank = quantile * snapshot["count"]
+    seen = 0
+    for bound, count in zip(snapshot["buckets"], snapshot["counts"]):
+        seen += count
+        if seen >= rank:
+            return bound
+    return f">{snapshot['buckets'][-1]}"
+
+class PipelineMetrics:
+    # Counters only grow; totals kept elsewhere (e.g. writer stats) are copied
+    # in with set_total. Rates are computed between two dumps.
+    def __init__(self, component):
+        self.component = component
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+        self.last_seen = {}  # node -> epoch s of its newest sample
+        self._lock = threading.Lock()
+        self._previous = (time.monotonic(), {})
+
+    def inc(self, name, amount=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def set_total(self, name, value):
+        with self._lock:
+            self.counters[name] = value
+
+    def set_gauge(self, name, value):
+        with self._lock:
+            self.gauges[name] = value
+
+    def observe(self, name, values):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            for value in values:
+                histogram.observe(value)
+
+    def seen(self, node, timestamp):
+        self.last_seen[node] = timestamp
+
+    def snapshot(self):
+        now = time.monotonic()
+        with self._lock:
+            counters = dict(self.counters)
+            snapshot = {
+                "component": self.component,
+                "pid": os.getpid(),
+                "time": time.time(),
+                "counters": counters,
+                "gauges": dict(self.gauges),
+                "histograms": {name: h.snapshot() for name, h in self.histograms.items()},
+                "last_seen": dict(self.last_seen),
+            }
+        previous_time, previous = self._previous
+        elapsed = now - previous_time
+        snapshot["rates"] = {name: round((value - previous.get(name, 0)) / elapsed, 3)
+                             for name, value in counters.items()} if elapsed > 0 else {}
+        self._previous = (now, counters)
+        return snapshot
+
+    def dump(self, directory=METRICS_DIR):
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"metrics-{self.component}.json")
+        tmp_path = path + ".tmp"
+        with open(tmp_path, mode='w') as file:
+            json.dump(self.snapshot(), file)
+        os.replace(tmp_path, path)
+
+def process_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True  # Exists, but belongs to someone else
+    return True
+
+def load_snapshots(directory=METRICS_DIR, max_age=METRICS_MAX_AGE):
+    # Only dumps of running processes that are still being refreshed
+    snapshots = []
+    try:
+        names = sorted(os.listdir(directory))
+    except OSError:
+        return snapshots
+    now = time.time()
+    for name in names:
+        if name.startswith("metrics-") and name.endswith(".json"):
+            try:
+                with open(os.path.join(directory, name), mode='r') as file:
+                    snapshot = json.load(file)
+            except (OSError, ValueError):
+                continue
+            pid = snapshot.get("pid")
+            if not pid or now - snapshot.get("time", 0) > max_age or not process_running(pid):
+                continue
+            snapshots.append(snapshot)
+    return snapshots
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(**labels):
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items()) + "}"
+
+def prometheus_text(snapshots, prefix="pipeline"):
+    # Prometheus text exposition format; series of all components are grouped per metric
+    families = {}  # metric name -> (type, lines)
+
+    def add(name, kind, line):
+        families.setdefault(name, (kind, []))[1].append(line)
+
+    now = time.time()
+    for snapshot in snapshots:
+        component = snapshot["component"]
+        add(f"{prefix}_metrics_age_seconds", "gauge",
+            f"{prefix}_metrics_age_seconds{_labels(component=component)} {now - snapshot['time']:.3f}")
+        for name, value in snapshot["counters"].items():
+            add(f"{prefix}_{name}_total", "counter", f"{prefix}_{name}_total{_labels(component=component)} {value}")
+        for name, value in snapshot["gauges"].items():
+            add(f"{prefix}_{name}", "gauge", f"{prefix}_{name}{_labels(component=component)} {float(value)}")
+        for name, histogram in snapshot["histograms"].items():
+            metric = f"{prefix}_{name}"
+            cumulative = 0
+            for bound, count in zip(histogram["buckets"] + ["+Inf"], histogram["counts"]):
+                cumulative += count
+                add(metric, "histogram", f"{metric}_bucket{_labels(component=component, le=bound)} {cumulative}")
+            add(metric, "histogram", f"{metric}_sum{_labels(component=component)} {histogram['sum']}")
+            add(metric, "histogram", f"{metric}_count{_labels(component=component)} {histogram['count']}")
+        for node, timestamp in snapshot.get("last_seen", {}).items():
+            add(f"{prefix}_node_last_seen_age_seconds", "gauge",
+                f"{prefix}_node_last_seen_age_seconds{_labels(component=component, node=node)} {now - timestamp:.3f}")
+    lines = []
+    for name, (kind, family_lines) in families.items():
+        lines.append(f"# TYPE {name} {kind}")
+        lines.extend(family_lines)
+    return "\n".join(lines) + "\n"
+
+def status_view(snapshots, stale_after=60):
+    # Compact JSON: rates, gauges, totals, latency quantiles and stale node counts per component
+    now = time.time()
+    view = {}
+    for snapshot in snapshots:
+        ages = {node: now - timestamp for node, timestamp in snapshot.get("last_seen", {}).items()}
+        stale = sorted((age, node) for node, age in ages.items() if age > stale_after)
+        view[snapshot["component"]] = {
+            "age": round(now - snapshot["time"], 1),
+            "rates": snapshot.get("rates", {}),
+            "totals": snapshot["counters"],
+            "gauges": snapshot["gauges"],
+            "latency": {name: {"count": h["count"],
+                               "mean": round(h["sum"] / h["count"], 4) if h["count"] else None,
+                               "p50": histogram_quantile(h, 0.5), "p95": histogram_quantile(h, 0.95),
+                               "p99": histogram_quantile(h, 0.99)}
+                        for name, h in snapshot["histograms"].items()},
+            "nodes": len(ages),
+            "stale_nodes": len(stale),
+            "oldest_nodes": {node: round(age, 1) for age, node in stale[-10:][::-1]},
+        }
+    return view
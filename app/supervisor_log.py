@@ -0,0 +1,160 @@
+import asyncio
+import os
+import time
+from datetime import datetime
+
+# Captures the output of the converter processes started by the web app.
+# stdout and stderr are read concurrently, lines go to a log file that stays
+# open and rotates by size and age, and the per-sample lines the converters
+# print are sampled and summarized instead of being written one by one.
+MAX_BYTES = int(os.environ.get('CONVERTER_LOG_MAX_BYTES', 50 * 1024 * 1024))
+ROTATE_INTERVAL = int(os.environ.get('CONVERTER_LOG_ROTATE_INTERVAL', 24 * 3600))  # s
+BACKUP_COUNT = int(os.environ.get('CONVERTER_LOG_BACKUPS', 5))
+FLUSH_INTERVAL = float(os.environ.get('CONVERTER_LOG_FLUSH_INTERVAL', 1))  # s
+# Per-sample lines written as they are per summary interval, the rest is only counted
+SAMPLE_LINES_PER_INTERVAL = int(os.environ.get('SAMPLE_LOG_LINES_PER_INTERVAL', 10))
+SUMMARY_INTERVAL = int(os.environ.get('SAMPLE_LOG_SUMMARY_INTERVAL', 10))  # s
+STREAM_LIMIT = 1024 * 1024  # Longest line read from a child
+
+# Line prefix -> what the summary calls it
+SAMPLE_LINE_PREFIXES = {"Published: ": "published", "Data buffered: ": "buffered"}
+
+def timestamp():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+class RotatingLogWriter:
+    # Append mode, so writes keep landing at the end when the file is
+    # truncated from outside (e.g. by /clear_logs)
+    def __init__(self, path, max_bytes=MAX_BYTES, rotate_interval=ROTATE_INTERVAL, backup_count=BACKUP_COUNT):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.rotate_interval = rotate_interval
+        self.backup_count = backup_count
+        self._open()
+
+    def _open(self):
+        self.file = open(self.path, mode='a', buffering=64 * 1024)
+        self.opened = time.monotonic()
+
+    def write(self, line):
+        self.file.write(line)
+
+    def flush(self):
+        self.file.flush()
+        if (os.fstat(self.file.fileno()).st_size >= self.max_bytes
+                or time.monotonic() - self.opened >= self.rotate_interval):
+            self.rotate()
+
+    def rotate(self):
+        self.file.close()
+        if self.backup_count > 0:
+            for index in range(self.backup_count - 1, 0, -1):
+                if os.path.exists(f"{self.path}.{index}"):
+                    os.replace(f"{self.path}.{index}", f"{self.path}.{index + 1}")
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self._open()
+
+    def close(self):
+        self.file.close()
+
+class SampleLineSummarizer:
+    # Lets the first SAMPLE_LINES_PER_INTERVAL per-sample lines of an interval
+    # through and reports how many there were in total once the interval ends
+    def __init__(self, lines_per_interval=SAMPLE_LINES_PER_INTERVAL, interval=SUMMARY_INTERVAL):
+        self.lines_per_interval = lines_per_interval
+        self.interval = interval
+        self.counts = dict.fromkeys(SAMPLE_LINE_PREFIXES.values(), 0)
+        self.passed = 0
+        self.started = time.monotonic()
+
+    def accept(self, line):
+        for prefix, kind in SAMPLE_LINE_PREFIXES.items():
+            if line.startswith(prefix):
+                self.counts[kind] += 1
+                self.passed += 1
+                return self.passed <= self.lines_per_interval
+        return True
+
+    def summary(self, final=False):
+        # One line per interval with sample lines in it, None otherwise
+        elapsed = time.monotonic() - self.started
+        if elapsed < self.interval and not final:
+            return None
+        parts = [f"{kind} {count:,} values" for kind, count in self.counts.items() if count]
+        suppressed = max(0, self.passed - self.lines_per_interval)
+        self.counts = dict.fromkeys(self.counts, 0)
+        self.passed = 0
+        self.started = time.monotonic()
+        if not parts:
+            return None
+        return f"{', '.join(parts)} in last {elapsed:.0f} s ({suppressed:,} lines not logged)"
+
+class ConverterLog:
+    # One per log file, shared by every process writing to it (e.g. the
+    # workers of a sharded converter); the file is open while any of them runs
+    def __init__(self, path, name):
+        self.path = path
+        self.name = name
+        self.writer = None
+        self.summarizer = SampleLineSummarizer()
+        self._captures = 0
+        self._ticker = None
+
+    def write(self, label, text):
+        self.writer.write(f"[{timestamp()}] {label}: {text}\n")
+
+    def write_summary(self, final=False):
+        summary = self.summarizer.summary(final)
+        if summary:
+            self.write(self.name, summary)
+
+    async def tick(self):
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            self.write_summary()
+            self.writer.flush()
+
+    async def pump(self, stream, label, stats):
+        skipping = False
+        while True:
+            try:
+                line = await stream.readuntil(b"\n")
+            except asyncio.IncompleteReadError as e:
+                line = e.partial  # Output ended without a newline
+            except asyncio.LimitOverrunError as e:
+                # Longer than STREAM_LIMIT: the buffered part is dropped here, the rest of the
+                # line (up to its newline, which may already have been buffered) by the next read
+                await stream.readexactly(e.consumed)
+                if not skipping:
+                    self.write(label, "<line too long, skipped>")
+                skipping = True
+                continue
+            if not line:
+                break
+            if skipping:
+                skipping = False
+                continue
+            stats["lines"] += 1
+            stats["last_output"] = time.time()
+            text = line.decode(errors='replace').strip()
+            if self.summarizer.accept(text):
+                self.write(label, text)
+
+    async def capture(self, process, label, stats):
+        # stats is updated with the number of lines and the time of the last one
+        stats.setdefault("lines", 0)
+        stats.setdefault("last_output", None)
+        if not self._captures:
+            self.writer = RotatingLogWriter(self.path)
+            self._ticker = asyncio.create_task(self.tick())
+        self._captures += 1
+        try:
+            await asyncio.gather(self.pump(process.stdout, label, stats), self.pump(process.stderr, f"{label} Error", stats))
+        finally:
+            self._captures -= 1
+            if not self._captures:
+                self._ticker.cancel()
+                self.write_summary(final=True)
+                self.writer.close()
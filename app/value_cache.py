@@ -0,0 +1,104 @@
+import os
+import threading
+from collections import OrderedDict
+
+# Latest value, timestamp and status of every node the bridge publishes, kept
+# by the web app from its MQTT subscription. Every change gets the next version
+# number and moves the node to the end of the change order, so changes_since()
+# only walks back over the nodes that changed after the version a client saw.
+# Samples that repeat a node's value and status just refresh its timestamp.
+MAX_NODES = int(os.environ.get('VALUE_CACHE_MAX_NODES', 200000))
+
+class ValueSlot:
+    __slots__ = ("value", "timestamp_ns", "status", "version")
+
+    def __init__(self, value, timestamp_ns, status, version):
+        self.value = value
+        self.timestamp_ns = timestamp_ns
+        self.status = status
+        self.version = version
+
+    def entry(self):
+        return {"value": self.value, "ts": self.timestamp_ns, "status": self.status, "version": self.version}
+
+class LatestValueCache:
+    def __init__(self, max_nodes=MAX_NODES):
+        self.max_nodes = max_nodes
+        self._slots = OrderedDict()  # node -> ValueSlot, least recently changed first
+        self._lock = threading.Lock()
+        self.version = 0
+        self.updates = 0
+        self.coalesced = 0
+        self.out_of_order = 0
+        self.rejected = 0
+        self.invalid_payloads = 0
+
+    def update(self, samples, received_ns):
+        # samples are payload_codec (node_id, value, timestamp_ns, status) tuples;
+        # those without a source timestamp get the time they were received
+        with self._lock:
+            for node, value, timestamp_ns, status in samples:
+                timestamp_ns = timestamp_ns or received_ns
+                slot = self._slots.get(node)
+                if slot is None:
+                    if len(self._slots) >= self.max_nodes:
+                        self.rejected += 1
+                        continue
+                    self.version += 1
+                    self._slots[node] = ValueSlot(value, timestamp_ns, status, self.version)
+                    self.updates += 1
+                    continue
+                if timestamp_ns < slot.timestamp_ns:
+                    # e.g. a sample the bridge had queued while a newer one got through
+                    self.out_of_order += 1
+                    continue
+                if value == slot.value and status == slot.status:
+                    slot.timestamp_ns = timestamp_ns
+                    self.coalesced += 1
+                    continue
+                self.version += 1
+                slot.value = value
+                slot.timestamp_ns = timestamp_ns
+                slot.status = status
+                slot.version = self.version
+                self._slots.move_to_end(node)
+                self.updates += 1
+
+    def get(self, node):
+        with self._lock:
+            slot = self._slots.get(node)
+            return slot.entry() if slot else None
+
+    def snapshot(self, nodes=None):
+        with self._lock:
+            if nodes is None:
+                values = {node: slot.entry() for node, slot in self._slots.items()}
+            else:
+                values = {node: self._slots[node].entry() for node in nodes if node in self._slots}
+            return self.version, values
+
+    def changes_since(self, version, nodes=None):
+        # (current version, values, reset): reset means the client's version is
+        # from before a restart of the web app and values is a full snapshot
+        if version > self.version:
+            return (*self.snapshot(nodes), True)
+        changed = {}
+        with self._lock:
+            for node in reversed(self._slots):
+                slot = self._slots[node]
+                if slot.version <= version:
+                    break
+                if nodes is None or node in nodes:
+                    changed[node] = slot.entry()
+            return self.version, changed, False
+
+    def stats(self):
+        return {
+            "nodes": len(self._slots),
+            "version": self.version,
+            "updates": self.updates,
+            "coalesced": self.coalesced,
+            "out_of_order": self.out_of_order,
+            "rejected": self.rejected,
+            "invalid_payloads": self.invalid_payloads,
+        }
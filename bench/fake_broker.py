@@ -0,0 +1,125 @@
+import asyncio
+import struct
+
+# Minimal in-process MQTT 3.1.1 broker for the benchmarks: CONNECT, SUBSCRIBE
+# with + and # wildcards, PUBLISH (QoS 1 is acknowledged, delivery is always
+# QoS 0), PINGREQ and DISCONNECT. No retained messages, sessions or auth.
+
+CONNECT, CONNACK, PUBLISH, PUBACK, SUBSCRIBE, SUBACK, UNSUBSCRIBE, UNSUBACK, PINGREQ, PINGRESP, DISCONNECT = \
+    1, 2, 3, 4, 8, 9, 10, 11, 12, 13, 14
+
+def topic_matches(topic_filter, topic):
+    filter_parts, topic_parts = topic_filter.split("/"), topic.split("/")
+    for index, part in enumerate(filter_parts):
+        if part == "#":
+            return True
+        if index >= len(topic_parts) or (part != "+" and part != topic_parts[index]):
+            return False
+    return len(filter_parts) == len(topic_parts)
+
+def encode_packet(header, body):
+    length, packet = len(body), bytearray([header])
+    while True:
+        byte, length = length % 128, length // 128
+        packet.append(byte | (128 if length else 0))
+        if not length:
+            break
+    return bytes(packet) + body
+
+async def read_packet(reader):
+    header = (await reader.readexactly(1))[0]
+    multiplier, length = 1, 0
+    while True:
+        byte = (await reader.readexactly(1))[0]
+        length += (byte & 127) * multiplier
+        multiplier *= 128
+        if not byte & 128:
+            break
+    return header, await reader.readexactly(length)
+
+def read_topic_filters(body, with_qos):
+    # Payload of SUBSCRIBE (every filter followed by a QoS byte) and UNSUBSCRIBE, after the packet id
+    filters, position = [], 2
+    while position < len(body):
+        length = struct.unpack_from("!H", body, position)[0]
+        filters.append(body[position + 2:position + 2 + length].decode())
+        position += 2 + length + (1 if with_qos else 0)
+    return filters
+
+class FakeBroker:
+    def __init__(self, host="127.0.0.1", port=0):
+        self.host = host
+        self.port = port
+        self._server = None
+        self._subscriptions = {}  # writer -> set of topic filters
+        self._routes = {}  # topic -> writers, cleared on every (un)subscribe
+        self.messages_received = 0
+        self.messages_delivered = 0
+        self.bytes_received = 0
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self._server.close()
+        for writer in list(self._subscriptions):
+            writer.close()
+        await self._server.wait_closed()
+
+    def _route(self, topic):
+        writers = self._routes.get(topic)
+        if writers is None:
+            writers = self._routes[topic] = [writer for writer, filters in self._subscriptions.items()
+                                             if any(topic_matches(f, topic) for f in filters)]
+        return writers
+
+    def _publish(self, header, body):
+        topic_length = struct.unpack_from("!H", body)[0]
+        topic = body[2:2 + topic_length].decode()
+        position, reply = 2 + topic_length, None
+        if (header >> 1) & 3:
+            reply = encode_packet(PUBACK << 4, body[position:position + 2])
+            position += 2
+        self.messages_received += 1
+        self.bytes_received += len(body)
+        writers = self._route(topic)
+        if writers:
+            packet = encode_packet(PUBLISH << 4, body[:2 + topic_length] + body[position:])
+            for writer in writers:
+                writer.write(packet)
+            self.messages_delivered += len(writers)
+        return reply
+
+    async def _handle(self, reader, writer):
+        self._subscriptions[writer] = set()
+        try:
+            while True:
+                header, body = await read_packet(reader)
+                kind = header >> 4
+                if kind == PUBLISH:
+                    reply = self._publish(header, body)
+                    if reply:
+                        writer.write(reply)
+                elif kind == CONNECT:
+                    writer.write(encode_packet(CONNACK << 4, b"\x00\x00"))
+                elif kind == SUBSCRIBE:
+                    filters = read_topic_filters(body, with_qos=True)
+                    self._subscriptions[writer].update(filters)
+                    self._routes.clear()
+                    writer.write(encode_packet(SUBACK << 4, body[:2] + bytes(len(filters))))
+                elif kind == UNSUBSCRIBE:
+                    self._subscriptions[writer].difference_update(read_topic_filters(body, with_qos=False))
+                    self._routes.clear()
+                    writer.write(encode_packet(UNSUBACK << 4, body[:2]))
+                elif kind == PINGREQ:
+                    writer.write(encode_packet(PINGRESP << 4, b""))
+                elif kind == DISCONNECT:
+                    break
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._subscriptions.pop(writer, None)
+            self._routes.clear()
+            writer.close()
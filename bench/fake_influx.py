@@ -0,0 +1,59 @@
+import gzip
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Fake InfluxDB v2 write endpoint for the benchmarks. Every POST to
+# /api/v2/write is acknowledged with 204 and its line protocol points are
+# counted; nothing is stored. fail_next makes the next n writes return 503.
+
+class _WriteHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        influx = self.server.influx
+        if not self.path.startswith("/api/v2/write"):
+            self._reply(404)
+            return
+        if self.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        with influx.lock:
+            if influx.fail_next > 0:
+                influx.fail_next -= 1
+                influx.failed_requests += 1
+                self._reply(503)
+                return
+            influx.requests += 1
+            influx.points += sum(1 for line in body.splitlines() if line and not line.startswith(b"#"))
+            influx.bytes += len(body)
+        self._reply(204)
+
+    def _reply(self, status):
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+class FakeInflux:
+    def __init__(self, host="127.0.0.1", port=0):
+        self.server = ThreadingHTTPServer((host, port), _WriteHandler)
+        self.server.daemon_threads = True
+        self.server.influx = self
+        self.url = f"http://{host}:{self.server.server_address[1]}"
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.failed_requests = 0
+        self.points = 0
+        self.bytes = 0
+        self.fail_next = 0
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+import argparse
+import asyncio
+import math
+import time
+from datetime import datetime, timezone
+from asyncua import Server, ua
+
+# Local OPC UA server for the benchmarks: `tags` Double variables
+# ns=2;s=Bench.Tag<i>, of which `change_fraction` get a new value (with a fresh
+# source timestamp) every `change_interval` seconds. The changing window moves
+# on every round, so over time every tag changes at the same rate.
+
+NAMESPACE_URI = "urn:dataforge:bench"
+
+def node_id_string(namespace_index, index):
+    return f"ns={namespace_index};s=Bench.Tag{index}"
+
+async def serve(tags, port, change_interval, change_fraction):
+    server = Server()
+    await server.init()
+    server.set_endpoint(f"opc.tcp://127.0.0.1:{port}")
+    namespace_index = await server.register_namespace(NAMESPACE_URI)
+    folder = await server.nodes.objects.add_object(ua.NodeId("Bench", namespace_index), "Bench")
+    node_ids = []
+    for index in range(tags):
+        node_id = ua.NodeId(f"Bench.Tag{index}", namespace_index)
+        await folder.add_variable(node_id, f"Tag{index}", 0.0)
+        node_ids.append(node_id)
+
+    per_round = max(1, round(tags * change_fraction)) if tags else 0
+    async with server:
+        print(f"Serving {tags} tags on opc.tcp://127.0.0.1:{port} (namespace {namespace_index}), "
+              f"{per_round} changes every {change_interval} s", flush=True)
+        start, rounds, late = 0, 0, 0
+        next_round = time.monotonic()
+        while True:
+            next_round += change_interval
+            now = datetime.now(timezone.utc)
+            for offset in range(per_round):
+                index = (start + offset) % tags
+                value = ua.DataValue(ua.Variant(math.sin(rounds + index), ua.VariantType.Double), SourceTimestamp=now)
+                await server.write_attribute_value(node_ids[index], value)
+            start = (start + per_round) % tags
+            rounds += 1
+            delay = next_round - time.monotonic()
+            if delay < 0:
+                # The server can't keep up; the offered rate is lower than configured
+                late += 1
+                if late % 10 == 1:
+                    print(f"Change round {rounds} late by {-delay:.3f} s ({late} late rounds)", flush=True)
+                next_round = time.monotonic()
+                delay = 0
+            await asyncio.sleep(delay)
+
+def main():
+    parser = argparse.ArgumentParser(description="Local OPC UA server with changing Double variables")
+    parser.add_argument("--tags", type=int, default=100)
+    parser.add_argument("--port", type=int, default=4841)
+    parser.add_argument("--change-interval", type=float, default=1.0, help="s between change rounds")
+    parser.add_argument("--change-fraction", type=float, default=0.1, help="share of the tags changed per round")
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.tags, args.port, args.change_interval, args.change_fraction))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
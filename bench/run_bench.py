@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+import argparse
+import asyncio
+import csv
+import json
+import os
+import re
+import shutil
+import signal
+import sys
+import tempfile
+import time
+from fake_broker import FakeBroker
+from fake_influx import FakeInflux
+from opcua_server import node_id_string
+
+# End-to-end load test: a local OPC UA server (subprocess), the in-process fake
+# MQTT broker and fake InfluxDB, and both converters started the way the web
+# app starts them, each in its own working directory. After a warmup the
+# converters' metrics dumps (app/state) are diffed over the measurement window
+# for throughput and latency; CPU and RSS come from /proc, so this is Linux only.
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_DIR = os.path.join(os.path.dirname(BENCH_DIR), "app")
+sys.path.insert(0, APP_DIR)
+from pipeline_metrics import histogram_quantile  # noqa: E402
+
+OPCUA_TO_MQTT_SCRIPT = os.path.join(APP_DIR, "opcua_to_MQTT_Converter.py")
+MQTT_TO_INFLUX_SCRIPT = os.path.join(APP_DIR, "mqtt_to_Influx_Converter.py")
+OPCUA_SERVER_SCRIPT = os.path.join(BENCH_DIR, "opcua_server.py")
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+QUANTILES = (("p50", 0.5), ("p95", 0.95), ("p99", 0.99))
+
+def process_cpu_seconds(pid):
+    with open(f"/proc/{pid}/stat", mode='r') as file:
+        fields = file.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS  # utime + stime
+
+def process_rss_mib(pid):
+    with open(f"/proc/{pid}/status", mode='r') as file:
+        for line in file:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+def read_metrics(state_dir, component):
+    try:
+        with open(os.path.join(state_dir, f"metrics-{component}.json"), mode='r') as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+def histogram_delta(before, after):
+    if not after:
+        return None
+    if not before:
+        return after
+    return {"buckets": after["buckets"], "counts": [a - b for a, b in zip(after["counts"], before["counts"])],
+            "sum": after["sum"] - before["sum"], "count": after["count"] - before["count"]}
+
+def latency_summary(histogram):
+    if not histogram or not histogram["count"]:
+        return None
+    summary = {name: histogram_quantile(histogram, quantile) for name, quantile in QUANTILES}
+    summary["mean"] = round(histogram["sum"] / histogram["count"], 4)
+    return summary
+
+def write_selection(work_dir, tags, namespace_index, mode, change_interval):
+    # Poll mode reads every tag once per change interval, subscription mode uses the sampling interval
+    app_dir = os.path.join(work_dir, "app")
+    os.makedirs(app_dir, exist_ok=True)
+    with open(os.path.join(app_dir, "selected.csv"), mode='w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(["node_id", "description", "interval"])
+        for index in range(tags):
+            writer.writerow([node_id_string(namespace_index, index), f"Bench tag {index}",
+                             change_interval if mode == "poll" else ""])
+    with open(os.path.join(app_dir, "converter_settings.json"), mode='w') as file:
+        json.dump({"read_interval": max(1, round(change_interval))}, file)
+
+class BenchProcess:
+    def __init__(self, name, process, log_file=None):
+        self.name = name
+        self.process = process
+        self.log_file = log_file
+        self.max_rss = 0.0
+
+    def sample(self):
+        self.max_rss = max(self.max_rss, process_rss_mib(self.process.pid))
+        return process_cpu_seconds(self.process.pid)
+
+    async def stop(self, timeout=10):
+        if self.process.returncode is None:
+            self.process.send_signal(signal.SIGINT)
+            try:
+                await asyncio.wait_for(self.process.wait(), timeout)
+            except asyncio.TimeoutError:
+                self.process.kill()
+                await self.process.wait()
+        if self.log_file:
+            self.log_file.close()
+
+async def start_opcua_server(tags, port, change_interval, change_fraction, work_dir, timeout):
+    # Creating thousands of variables takes a while; the server prints one line once it serves
+    log_file = open(os.path.join(work_dir, "opcua_server.log"), mode='wb')
+    process = await asyncio.create_subprocess_exec(
+        sys.executable, OPCUA_SERVER_SCRIPT, "--tags", str(tags), "--port", str(port),
+        "--change-interval", str(change_interval), "--change-fraction", str(change_fraction),
+        stdout=asyncio.subprocess.PIPE, stderr=log_file)
+    server = BenchProcess("opcua_server", process, log_file)
+    try:
+        line = await asyncio.wait_for(process.stdout.readline(), timeout)
+    except asyncio.TimeoutError:
+        line = b""
+    match = re.search(rb"\(namespace (\d+)\)", line)
+    if not match:
+        await server.stop()
+        raise RuntimeError(f"OPC UA server didn't start within {timeout} s")
+    # Keep reading its output so a chatty server never blocks on a full pipe
+    asyncio.create_task(drain(process.stdout))
+    return server, int(match.group(1))
+
+async def drain(stream):
+    while await stream.readline():
+        pass
+
+async def start_converter(name, script, work_dir, env):
+    log_file = open(os.path.join(work_dir, f"{name}.log"), mode='wb')
+    process = await asyncio.create_subprocess_exec(sys.executable, script, cwd=work_dir, env=env,
+                                                   stdout=log_file, stderr=asyncio.subprocess.STDOUT)
+    return BenchProcess(name, process, log_file)
+
+async def wait_for_flow(state_dir, processes, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        for process in processes:
+            if process.process.returncode is not None:
+                raise RuntimeError(f"{process.name} exited with {process.process.returncode}, see its log")
+        bridge = read_metrics(state_dir, "opcua_to_mqtt")
+        influx = read_metrics(state_dir, "mqtt_to_influx")
+        if (bridge and bridge["counters"].get("samples_published")
+                and influx and influx["counters"].get("points_written")):
+            return
+        await asyncio.sleep(0.5)
+    raise RuntimeError(f"No samples reached the fake InfluxDB within {timeout} s")
+
+def take_snapshot(state_dir, processes, broker, influx):
+    return {
+        "time": time.monotonic(),
+        "cpu": {process.name: process.sample() for process in processes},
+        "bridge": read_metrics(state_dir, "opcua_to_mqtt"),
+        "influx": read_metrics(state_dir, "mqtt_to_influx"),
+        "broker_messages": broker.messages_received,
+        "influx_points": influx.points,
+    }
+
+def summarize(tags, args, before, after):
+    elapsed = after["time"] - before["time"]
+
+    def rate(component, counter):
+        # Converter counters are timed by their own dumps, not by when they were read
+        first, last = before[component], after[component]
+        dump_elapsed = last["time"] - first["time"]
+        if dump_elapsed <= 0:
+            return None
+        return round((last["counters"].get(counter, 0) - first["counters"].get(counter, 0)) / dump_elapsed, 1)
+
+    def delta(component, counter):
+        return after[component]["counters"].get(counter, 0) - before[component]["counters"].get(counter, 0)
+
+    def latency(component, name):
+        return latency_summary(histogram_delta(before[component]["histograms"].get(name),
+                                               after[component]["histograms"].get(name)))
+
+    return {
+        "tags": tags,
+        "offered_per_s": round(tags * args.change_fraction / args.change_interval, 1),
+        "read_per_s": rate("bridge", "samples_read"),
+        "published_per_s": rate("bridge", "samples_published"),
+        "broker_messages_per_s": round((after["broker_messages"] - before["broker_messages"]) / elapsed, 1),
+        "written_per_s": rate("influx", "points_written"),
+        "influx_points_per_s": round((after["influx_points"] - before["influx_points"]) / elapsed, 1),
+        "publish_latency": latency("bridge", "source_to_publish_seconds"),
+        "write_latency": latency("influx", "source_to_write_seconds"),
+        # A stalled OPC UA session (e.g. the stand-in server falling behind) shows up as reconnects
+        "reconnects": {"opcua": delta("bridge", "opcua_reconnects"), "mqtt": delta("bridge", "mqtt_disconnects")},
+        "dropped": {"publish_queue": delta("bridge", "publish_queue_dropped"),
+                    "influx_writer": delta("influx", "points_dropped")},
+        "publish_queue_depth": after["bridge"]["gauges"].get("publish_queue_depth"),
+        "writer_pending": after["influx"]["gauges"].get("writer_pending"),
+        "cpu_percent": {name: round((after["cpu"][name] - before["cpu"][name]) / elapsed * 100, 1)
+                        for name in after["cpu"]},
+    }
+
+async def run_case(tags, args, broker, influx):
+    work_dir = tempfile.mkdtemp(prefix=f"bench-{tags}-")
+    state_dir = os.path.join(work_dir, "app", "state")
+    env = {**os.environ,
+           "OPC_SERVER_URL": f"opc.tcp://127.0.0.1:{args.opcua_port}",
+           "MQTT_BROKER": "127.0.0.1",
+           "MQTT_PORT": str(broker.port),
+           "INFLUXDB_URL": influx.url,
+           "ACQUISITION_MODE": args.mode,
+           "METRICS_INTERVAL": "1",
+           "INFLUX_SPOOL_ENABLED": "false",
+           "PYTHONUNBUFFERED": "1",
+           **dict(setting.split("=", 1) for setting in args.env)}
+    processes = []
+    try:
+        server, namespace_index = await start_opcua_server(tags, args.opcua_port, args.change_interval,
+                                                           args.change_fraction, work_dir, args.startup_timeout)
+        processes.append(server)
+        write_selection(work_dir, tags, namespace_index, args.mode, args.change_interval)
+        processes.append(await start_converter("mqtt_to_influx", MQTT_TO_INFLUX_SCRIPT, work_dir, env))
+        processes.append(await start_converter("opcua_to_mqtt", OPCUA_TO_MQTT_SCRIPT, work_dir, env))
+        await wait_for_flow(state_dir, processes, args.startup_timeout)
+        await asyncio.sleep(args.warmup)
+
+        before = take_snapshot(state_dir, processes, broker, influx)
+        deadline = before["time"] + args.duration
+        while time.monotonic() < deadline:
+            await asyncio.sleep(min(1.0, max(0.0, deadline - time.monotonic())))
+            for process in processes:
+                process.sample()
+        # Let both converters dump once more so their last second is included
+        await asyncio.sleep(1.5)
+        after = take_snapshot(state_dir, processes, broker, influx)
+
+        result = summarize(tags, args, before, after)
+        result["rss_mib"] = {process.name: round(process.max_rss, 1) for process in processes}
+        return result
+    finally:
+        for process in reversed(processes):
+            await process.stop()
+        if args.keep:
+            print(f"Working directory kept: {work_dir}", file=sys.stderr)
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+def format_latency(summary):
+    if not summary:
+        return "-"
+    return "/".join(str(summary[name]) for name, _ in QUANTILES)
+
+def print_table(results):
+    columns = [
+        ("tags", lambda r: r["tags"]),
+        ("offered/s", lambda r: r["offered_per_s"]),
+        ("published/s", lambda r: r["published_per_s"]),
+        ("written/s", lambda r: r["written_per_s"]),
+        ("publish p50/95/99 s", lambda r: format_latency(r["publish_latency"])),
+        ("write p50/95/99 s", lambda r: format_latency(r["write_latency"])),
+        ("dropped", lambda r: sum(r["dropped"].values())),
+        ("reconnects", lambda r: sum(r["reconnects"].values())),
+        ("bridge cpu%", lambda r: r["cpu_percent"]["opcua_to_mqtt"]),
+        ("bridge MiB", lambda r: r["rss_mib"]["opcua_to_mqtt"]),
+        ("influx cpu%", lambda r: r["cpu_percent"]["mqtt_to_influx"]),
+        ("influx MiB", lambda r: r["rss_mib"]["mqtt_to_influx"]),
+        ("server cpu%", lambda r: r["cpu_percent"]["opcua_server"]),
+    ]
+    rows = [[str(value(result)) for _, value in columns] for result in results]
+    widths = [max(len(title), *(len(row[index]) for row in rows)) for index, (title, _) in enumerate(columns)]
+    print("  ".join(title.rjust(width) for (title, _), width in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(cell.rjust(width) for cell, width in zip(row, widths)))
+
+async def main(args):
+    broker = FakeBroker()
+    await broker.start()
+    influx = FakeInflux()
+    influx.start()
+    results = []
+    try:
+        for tags in args.tags:
+            print(f"Running {tags} tags: {args.warmup} s warmup, {args.duration} s measured", file=sys.stderr)
+            results.append(await run_case(tags, args, broker, influx))
+    finally:
+        influx.stop()
+        await broker.stop()
+    print_table(results)
+    if args.json:
+        with open(args.json, mode='w') as file:
+            json.dump({"settings": {"mode": args.mode, "change_interval": args.change_interval,
+                                    "change_fraction": args.change_fraction, "duration": args.duration,
+                                    "env": args.env},
+                       "results": results}, file, indent=2)
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="End-to-end load test of the OPC UA to MQTT and MQTT to InfluxDB converters")
+    parser.add_argument("--tags", type=lambda text: [int(part) for part in text.split(",")], default=[100, 1000, 10000],
+                        help="comma separated tag counts, one run each (default 100,1000,10000)")
+    parser.add_argument("--duration", type=float, default=30, help="measured s per run")
+    parser.add_argument("--warmup", type=float, default=10, help="s between the first written point and the measurement")
+    parser.add_argument("--change-interval", type=float, default=1.0, help="s between value changes on the server")
+    parser.add_argument("--change-fraction", type=float, default=0.1,
+                        help="share of the tags changed each interval (default 0.1; the asyncua server stalls near 10k changes/s)")
+    parser.add_argument("--mode", choices=("subscription", "poll"), default="subscription", help="ACQUISITION_MODE")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="extra environment for both converters, e.g. PAYLOAD_FORMAT=binary")
+    parser.add_argument("--opcua-port", type=int, default=48410)
+    parser.add_argument("--startup-timeout", type=float, default=300, help="s to wait for the server and the first points")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("--keep", action="store_true", help="keep the working directories (converter logs, metrics)")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    asyncio.run(main(parse_args()))
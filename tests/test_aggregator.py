@@ -0,0 +1,74 @@
+import pytest
+
+from app.aggregator import NS_PER_S, WindowAggregator, parse_windows, window_label
+
+def make_aggregator(windows=(10,), slots=2, grace=2.0):
+    emitted = []
+    aggregator = WindowAggregator(list(windows), lambda *row: emitted.append(row), slots=slots, grace=grace)
+    return aggregator, emitted
+
+def ts(seconds):
+    return int(seconds * NS_PER_S)
+
+def test_bucket_stats_are_emitted_once_pushed_out_of_the_ring():
+    aggregator, emitted = make_aggregator()
+    for seconds, value in [(1, 4.0), (3, 1.0), (2, 7.0)]:
+        aggregator.add("n", value, ts(seconds))
+    aggregator.add("n", 0.0, ts(12))
+    assert emitted == []
+    # Bucket 2 shares bucket 0's slot and closes it
+    aggregator.add("n", 0.0, ts(21))
+    assert emitted == [("n", "10s", 0, 3, 1.0, 7.0, 4.0, 1.0)]
+    assert aggregator.aggregated == 5
+    assert aggregator.emitted == 1
+
+def test_samples_older_than_the_ring_are_late():
+    aggregator, emitted = make_aggregator()
+    aggregator.add("n", 1.0, ts(21))
+    aggregator.add("n", 2.0, ts(1))
+    assert aggregator.late == 1
+    aggregator.flush_idle(force=True)
+    assert [row[2] for row in emitted] == [ts(20)]
+
+def test_flush_idle_force_emits_every_open_bucket():
+    aggregator, emitted = make_aggregator(windows=(10, 60))
+    aggregator.add("a", 1.0, ts(5))
+    aggregator.add("b", 2.0, ts(15))
+    aggregator.flush_idle(force=True)
+    assert sorted((row[0], row[1], row[2]) for row in emitted) == [
+        ("a", "10s", 0), ("a", "1m", 0), ("b", "10s", ts(10)), ("b", "1m", 0)]
+    emitted.clear()
+    aggregator.flush_idle(force=True)
+    assert emitted == []
+
+def test_flush_idle_waits_for_window_plus_grace(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr("app.aggregator.time.monotonic", lambda: clock[0])
+    aggregator, emitted = make_aggregator()
+    aggregator.add("n", 1.0, ts(5))
+    clock[0] += 11
+    aggregator.flush_idle()
+    assert emitted == []
+    clock[0] += 1
+    aggregator.flush_idle()
+    assert len(emitted) == 1
+
+def test_late_sample_after_flush_does_not_emit_the_bucket_twice():
+    aggregator, emitted = make_aggregator()
+    aggregator.add("n", 1.0, ts(5))
+    aggregator.flush_idle(force=True)
+    aggregator.add("n", 2.0, ts(6))
+    aggregator.flush_idle(force=True)
+    assert [row[2] for row in emitted] == [0]
+    assert aggregator.late == 1
+    # Newer buckets still open normally
+    aggregator.add("n", 3.0, ts(15))
+    aggregator.flush_idle(force=True)
+    assert [row[2] for row in emitted] == [0, ts(10)]
+
+@pytest.mark.parametrize("seconds, label", [(10, "10s"), (90, "90s"), (60, "1m"), (300, "5m"), (7200, "2h")])
+def test_window_label(seconds, label):
+    assert window_label(seconds) == label
+
+def test_parse_windows_sorts_and_deduplicates():
+    assert parse_windows("60, 10,,60,3600") == [10, 60, 3600]
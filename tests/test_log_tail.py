@@ -0,0 +1,116 @@
+import asyncio
+import os
+
+from app.log_tail import LogTailer, tail_lines
+
+def write(path, data, mode='ab'):
+    with open(path, mode=mode) as file:
+        file.write(data)
+
+def drain(queue):
+    events = []
+    while not queue.empty():
+        events.append(queue.get_nowait())
+    return events
+
+def with_tailer(files, check):
+    # subscribe() starts the watcher task, so the tailer needs a running loop;
+    # the tests drive poll() themselves
+    async def run():
+        tailer = LogTailer(files, poll_interval=3600)
+        queue = tailer.subscribe()
+        try:
+            check(tailer, queue)
+        finally:
+            tailer.unsubscribe(queue)
+    asyncio.run(run())
+
+def test_tail_lines_reads_backwards_across_blocks(tmp_path):
+    path = tmp_path / "app.log"
+    write(path, "".join(f"line {i}\n" for i in range(100)).encode())
+    assert tail_lines(path, 3, block_size=16) == ["line 97\n", "line 98\n", "line 99\n"]
+    assert tail_lines(path, 200, block_size=16) == [f"line {i}\n" for i in range(100)]
+    assert tail_lines(path, 0) == []
+
+def test_tail_lines_stops_at_end_offset(tmp_path):
+    path = tmp_path / "app.log"
+    write(path, b"a\nb\nc\nd\n")
+    assert tail_lines(path, 2, end=6) == ["b\n", "c\n"]
+
+def test_poll_publishes_only_complete_lines(tmp_path):
+    path = tmp_path / "app.log"
+    write(path, b"old\n")
+
+    def check(tailer, queue):
+        assert tailer.initial_lines("app", 10) == ["old\n"]
+        write(path, b"new 1\nnew ")
+        tailer.poll("app")
+        assert drain(queue) == [("lines", "app", ["new 1\n"])]
+        write(path, b"2\n")
+        tailer.poll("app")
+        assert drain(queue) == [("lines", "app", ["new 2\n"])]
+    with_tailer({"app": str(path)}, check)
+
+def test_line_being_written_at_subscribe_is_sent_once(tmp_path):
+    path = tmp_path / "app.log"
+    write(path, b"done\npartial")
+
+    def check(tailer, queue):
+        assert tailer.initial_lines("app", 10) == ["done\n"]
+        write(path, b" rest\n")
+        tailer.poll("app")
+        assert drain(queue) == [("lines", "app", ["partial rest\n"])]
+    with_tailer({"app": str(path)}, check)
+
+def test_late_subscriber_window_ends_before_pending_partial_line(tmp_path):
+    path = tmp_path / "app.log"
+    write(path, b"one\n")
+
+    def check(tailer, queue):
+        write(path, b"two\nthr")
+        tailer.poll("app")
+        drain(queue)
+        # What a second browser tab would get while "thr" is still incomplete
+        assert tailer.initial_lines("app", 10) == ["one\n", "two\n"]
+        write(path, b"ee\n")
+        tailer.poll("app")
+        assert drain(queue) == [("lines", "app", ["three\n"])]
+    with_tailer({"app": str(path)}, check)
+
+def test_truncated_or_replaced_file_resets(tmp_path):
+    path = tmp_path / "app.log"
+    write(path, b"first run\n")
+
+    def check(tailer, queue):
+        write(path, b"x\n", mode='wb')
+        tailer.poll("app")
+        assert drain(queue) == [("reset", "app", []), ("lines", "app", ["x\n"])]
+        replacement = tmp_path / "app.log.new"
+        write(replacement, b"rotated\n")
+        os.replace(replacement, path)
+        tailer.poll("app")
+        assert drain(queue) == [("reset", "app", []), ("lines", "app", ["rotated\n"])]
+    with_tailer({"app": str(path)}, check)
+
+def test_missing_file_is_picked_up_once_created(tmp_path):
+    path = tmp_path / "app.log"
+
+    def check(tailer, queue):
+        tailer.poll("app")
+        write(path, b"hello\n")
+        tailer.poll("app")
+        assert drain(queue)[-1] == ("lines", "app", ["hello\n"])
+    with_tailer({"app": str(path)}, check)
+
+def test_stalled_subscriber_loses_oldest_events(tmp_path):
+    path = tmp_path / "app.log"
+    write(path, b"")
+
+    def check(tailer, queue):
+        for i in range(queue.maxsize + 5):
+            write(path, f"{i}\n".encode())
+            tailer.poll("app")
+        events = drain(queue)
+        assert tailer.dropped == 5
+        assert events[0] == ("lines", "app", ["5\n"])
+    with_tailer({"app": str(path)}, check)
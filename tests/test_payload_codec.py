@@ -0,0 +1,49 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from app.payload_codec import decode_samples, encode_samples, to_epoch_ns
+
+SAMPLES = [
+    ("Tag1", 1.5, 1_700_000_000_123_456_000, 0),
+    ("Tag2", 42, 1_700_000_000_000_000_000, 0x80000000),
+    ("Tag3", True, 1, 0),
+    ("Tag4", "running", 2, 0),
+    ("Tag5", None, None, 0),
+    ("Täg/6", -2.25, 3, 0),
+]
+
+@pytest.mark.parametrize("payload_format", ["json", "binary"])
+def test_frame_round_trip(payload_format):
+    assert decode_samples(encode_samples(SAMPLES, payload_format)) == SAMPLES
+
+@pytest.mark.parametrize("payload_format", ["json", "binary"])
+def test_single_sample_round_trip(payload_format):
+    assert decode_samples(encode_samples(SAMPLES[:1], payload_format)) == SAMPLES[:1]
+
+def test_binary_keeps_value_types():
+    decoded = decode_samples(encode_samples(SAMPLES, "binary"))
+    assert [type(value) for _, value, _, _ in decoded] == [float, int, bool, str, type(None), float]
+
+def test_binary_sends_out_of_range_ints_as_strings():
+    assert decode_samples(encode_samples([("Big", 2 ** 64, 1, 0)], "binary")) == [("Big", str(2 ** 64), 1, 0)]
+
+def test_decodes_legacy_json_without_timestamp():
+    assert decode_samples(b'{"node_id": "Tag1", "value": 3.0}') == [("Tag1", 3.0, None, 0)]
+
+def test_decodes_legacy_single_quoted_payload():
+    assert decode_samples(b"{'node_id': 'Tag1', 'value': 3.0}") == [("Tag1", 3.0, None, 0)]
+
+def test_unknown_format_is_rejected():
+    with pytest.raises(ValueError):
+        encode_samples(SAMPLES, "xml")
+
+def test_unsupported_binary_version_is_rejected():
+    payload = bytearray(encode_samples(SAMPLES, "binary"))
+    payload[1] = 99
+    with pytest.raises(ValueError):
+        decode_samples(bytes(payload))
+
+def test_to_epoch_ns_treats_naive_datetimes_as_utc():
+    aware = datetime(2024, 1, 2, 3, 4, 5, 678901, tzinfo=timezone.utc)
+    assert to_epoch_ns(aware.replace(tzinfo=None)) == to_epoch_ns(aware) == 1_704_164_645_678_901_000
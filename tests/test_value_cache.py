@@ -0,0 +1,65 @@
+from app.value_cache import LatestValueCache
+
+def test_update_keeps_the_latest_value_per_node():
+    cache = LatestValueCache()
+    cache.update([("a", 1.0, 10, 0), ("b", 2.0, 10, 0), ("a", 3.0, 20, 0)], received_ns=99)
+    assert cache.get("a") == {"value": 3.0, "ts": 20, "status": 0, "version": 3}
+    assert cache.get("b")["value"] == 2.0
+    assert cache.get("c") is None
+    assert cache.version == 3
+    assert cache.updates == 3
+
+def test_samples_without_timestamp_get_the_receive_time():
+    cache = LatestValueCache()
+    cache.update([("a", 1.0, None, 0)], received_ns=99)
+    assert cache.get("a")["ts"] == 99
+
+def test_repeated_values_are_coalesced_without_a_new_version():
+    cache = LatestValueCache()
+    cache.update([("a", 1.0, 10, 0)], received_ns=0)
+    cache.update([("a", 1.0, 20, 0)], received_ns=0)
+    assert cache.get("a") == {"value": 1.0, "ts": 20, "status": 0, "version": 1}
+    assert cache.coalesced == 1
+    # A status change is a change even with the same value
+    cache.update([("a", 1.0, 30, 2)], received_ns=0)
+    assert cache.get("a")["version"] == 2
+
+def test_older_samples_are_out_of_order():
+    cache = LatestValueCache()
+    cache.update([("a", 1.0, 20, 0), ("a", 5.0, 10, 0)], received_ns=0)
+    assert cache.get("a")["value"] == 1.0
+    assert cache.out_of_order == 1
+
+def test_new_nodes_over_max_nodes_are_rejected():
+    cache = LatestValueCache(max_nodes=2)
+    cache.update([("a", 1.0, 10, 0), ("b", 1.0, 10, 0), ("c", 1.0, 10, 0)], received_ns=0)
+    assert cache.get("c") is None
+    assert cache.rejected == 1
+    # Known nodes still update
+    cache.update([("a", 2.0, 20, 0)], received_ns=0)
+    assert cache.get("a")["value"] == 2.0
+
+def test_changes_since_returns_only_newer_changes():
+    cache = LatestValueCache()
+    cache.update([("a", 1.0, 10, 0), ("b", 1.0, 10, 0), ("c", 1.0, 10, 0)], received_ns=0)
+    version, changed, reset = cache.changes_since(0)
+    assert (version, sorted(changed), reset) == (3, ["a", "b", "c"], False)
+    cache.update([("a", 2.0, 20, 0), ("b", 1.0, 20, 0)], received_ns=0)
+    version, changed, reset = cache.changes_since(3)
+    assert (version, list(changed), reset) == (4, ["a"], False)
+    assert changed["a"]["value"] == 2.0
+    assert cache.changes_since(4) == (4, {}, False)
+
+def test_changes_since_a_future_version_resets_with_a_snapshot():
+    cache = LatestValueCache()
+    cache.update([("a", 1.0, 10, 0), ("b", 1.0, 10, 0)], received_ns=0)
+    version, values, reset = cache.changes_since(50)
+    assert (version, sorted(values), reset) == (2, ["a", "b"], True)
+
+def test_changes_since_and_snapshot_filter_nodes():
+    cache = LatestValueCache()
+    cache.update([("a", 1.0, 10, 0), ("b", 1.0, 10, 0), ("c", 1.0, 10, 0)], received_ns=0)
+    assert list(cache.changes_since(1, nodes={"c", "x"})[1]) == ["c"]
+    assert list(cache.changes_since(99, nodes={"a"})[1]) == ["a"]
+    version, values = cache.snapshot(nodes=["b", "x"])
+    assert (version, list(values)) == (3, ["b"])